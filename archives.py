@@ -0,0 +1,163 @@
+import fnmatch
+import glob
+import io
+import mmap
+import os
+import posixpath
+import zipfile
+from contextlib import contextmanager
+
+ARCHIVE_EXTENSION = '.zip'
+
+# open archives of this process by path, with the pid and the stat they were opened with and the folders index
+archives = {}
+
+
+def split_archive_path(path):
+    # (archive, member) for paths that go through a zip archive, like export.zip/messages/1/messages0.html,
+    # (None, path) for everything on disk
+    lowered = path.replace('\\', '/').lower()
+    if ARCHIVE_EXTENSION not in lowered or (os.path.exists(path) and not os.path.isfile(path)):
+        return None, path
+    index = lowered.find(ARCHIVE_EXTENSION)
+    while index != -1:
+        end = index + len(ARCHIVE_EXTENSION)
+        archive = path[:end]
+        if (end == len(lowered) or lowered[end] == '/') and os.path.isfile(archive) \
+                and (archive in archives or zipfile.is_zipfile(archive)):
+            return archive, path[end:].replace('\\', '/').strip('/')
+        index = lowered.find(ARCHIVE_EXTENSION, end)
+    return None, path
+
+
+def is_archive(path):
+    archive, member = split_archive_path(path)
+    return archive is not None and member == ''
+
+
+def open_archive(archive):
+    # a handle per process, pool workers forked with the parent's handle would share its file position
+    stat = os.stat(archive)
+    key = (os.getpid(), stat.st_mtime_ns, stat.st_size)
+    entry = archives.get(archive)
+    if entry is None or entry[0] != key:
+        zip_file = zipfile.ZipFile(archive)
+        folders = {}
+        for name in zip_file.namelist():
+            parts = name.rstrip('/').split('/')
+            for depth in range(len(parts)):
+                folders.setdefault('/'.join(parts[:depth]), {})[parts[depth]] = True
+        entry = (key, zip_file, folders)
+        archives[archive] = entry
+    return entry
+
+
+def close_archives():
+    # a run closes the archives it opened, long lived processes like the window or batch workers run many of them
+    for _, zip_file, _ in archives.values():
+        zip_file.close()
+    archives.clear()
+
+
+def get_archive(archive):
+    return open_archive(archive)[1]
+
+
+def list_members(archive, folder):
+    # names of the files and folders right inside folder of the archive
+    return list(open_archive(archive)[2].get(folder, ()))
+
+
+def resolve_export(path, filename=None):
+    # the export folder, or its file for single file exports, of a path that may be an archive.
+    # Archives often keep the export in one top folder, the root is moved into it then
+    if not is_archive(path):
+        return path
+    root = path
+    folder = ''
+    while True:
+        children = list_members(path, folder)
+        if len(children) != 1 or filename in children:
+            break
+        child = posixpath.join(folder, children[0])
+        if not list_members(path, child):
+            break
+        folder = child
+        root = root + '/' + children[0]
+    return root + '/' + filename if filename else root
+
+
+def list_dir(path):
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return os.listdir(path)
+    return list_members(archive, member)
+
+
+def glob_files(folder, pattern):
+    archive, member = split_archive_path(folder)
+    if archive is None:
+        return glob.glob(os.path.join(folder, pattern))
+    return [folder + '/' + name for name in list_members(archive, member)
+            if fnmatch.fnmatch(name, pattern) and not name.startswith('.')]
+
+
+def get_size(path):
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return os.path.getsize(path)
+    return get_archive(archive).getinfo(member).file_size
+
+
+def open_file(path):
+    # binary file object, archive members are decompressed while they are read
+    archive, member = split_archive_path(path)
+    if archive is None:
+        return open(path, 'rb')
+    return get_archive(archive).open(member)
+
+
+def open_text_file(path, encoding):
+    return io.TextIOWrapper(open_file(path), encoding=encoding)
+
+
+class MemoryFile:
+    # the part of the mmap interface the readers use, for archive members decompressed into memory
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def seek(self, position):
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def find(self, sub, start=0):
+        return self.data.find(sub, start)
+
+    def readline(self):
+        end = self.data.find(b'\n', self.position)
+        end = len(self.data) if end == -1 else end + 1
+        line = self.data[self.position:end]
+        self.position = end
+        return line
+
+
+@contextmanager
+def map_file(path):
+    # read only mmap of the file, None for an empty one. Members of an archive can't be mapped, they are read whole
+    archive, member = split_archive_path(path)
+    if archive is not None:
+        data = get_archive(archive).read(member)
+        yield MemoryFile(data) if data else None
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield None
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
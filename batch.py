@@ -0,0 +1,114 @@
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from archives import close_archives
+from cli import get_input_size, run_job
+
+# rough peak memory of a job: the interpreter with pandas and the platform libraries loaded,
+# plus the chat being processed, which for vk pages and whatsapp files from archives is held whole
+JOB_BASE_MEMORY = 150 << 20
+JOB_MEMORY_PER_INPUT_BYTE = 0.1
+DEFAULT_RETRIES = 1
+
+
+def init_batch_worker():
+    # workers stay up between jobs, the processors and the emoji tables are loaded once per worker
+    from platforms import PROCESSORS, get_processor_class
+    for platform in PROCESSORS:
+        get_processor_class(platform)
+
+
+def run_batch_job(options):
+    # runs in a pool worker, errors are sent back instead of raised so the report keeps the traceback
+    lines = []
+    try:
+        report = run_job(log=lines.append, **options)
+    except Exception as e:
+        return None, lines, f"{repr(e)}\n{traceback.format_exc()}"
+    finally:
+        # workers run many jobs, archives opened by a job that failed before its processing are closed too
+        close_archives()
+    return report, lines, None
+
+
+def estimate_job_memory(options):
+    try:
+        input_size = get_input_size(options['input_path'])
+    except OSError:
+        input_size = 0
+    return JOB_BASE_MEMORY + int(input_size * JOB_MEMORY_PER_INPUT_BYTE)
+
+
+def get_failed_report(options, error, attempts):
+    return {
+        'platform': options['platform'],
+        'input': options['input_path'],
+        'output': options['output_path'],
+        'user_id': options['user_id'],
+        'status': 'failed',
+        'attempts': attempts,
+        'error': error,
+    }
+
+
+def run_batch(jobs, concurrency=1, memory_limit=None, retries=DEFAULT_RETRIES, log=print):
+    # jobs are run_job keyword arguments, they run in a shared pool of concurrency processes while
+    # their estimated memory fits memory_limit. A job that takes a worker down is retried alone
+    reports = [None] * len(jobs)
+    attempts = [0] * len(jobs)
+    isolated = set()
+    pending = deque(range(len(jobs)))
+    running = {}
+    executor = ProcessPoolExecutor(concurrency, initializer=init_batch_worker)
+    try:
+        while pending or running:
+            while pending and len(running) < concurrency:
+                index = pending[0]
+                memory = estimate_job_memory(jobs[index])
+                if running and (index in isolated or any(job in isolated for job, _ in running.values())
+                                or memory_limit and sum(used for _, used in running.values()) + memory > memory_limit):
+                    break
+                pending.popleft()
+                running[executor.submit(run_batch_job, jobs[index])] = (index, memory)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                index, _ = running.pop(future)
+                attempts[index] += 1
+                prefix = f"[{index + 1}/{len(jobs)}]"
+                try:
+                    report, lines, error = future.result()
+                except BrokenProcessPool:
+                    report, lines, error = None, [], "the worker process ended abruptly"
+                    broken = True
+                    isolated.add(index)
+                for line in lines:
+                    log(f"{prefix} {line}")
+                if error is None:
+                    report.update({'status': 'ok', 'attempts': attempts[index]})
+                    reports[index] = report
+                elif attempts[index] <= retries:
+                    log(f"{prefix} Failed, retrying: {error.splitlines()[0]}")
+                    pending.appendleft(index)
+                else:
+                    log(f"{prefix} Failed: {error}")
+                    reports[index] = get_failed_report(jobs[index], error, attempts[index])
+            if broken:
+                # the other jobs of a broken pool fail with it, they are retried in a new one
+                for future, (index, _) in running.items():
+                    attempts[index] += 1
+                    isolated.add(index)
+                    if attempts[index] <= retries:
+                        pending.appendleft(index)
+                    else:
+                        reports[index] = get_failed_report(jobs[index], "the worker process ended abruptly",
+                                                           attempts[index])
+                running = {}
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(concurrency, initializer=init_batch_worker)
+    finally:
+        executor.shutdown()
+    return reports
+
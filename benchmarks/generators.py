@@ -0,0 +1,229 @@
+import json
+import os
+import random
+import time
+
+# deterministic synthetic exports, messages start at a fixed date so the output doesn't depend on the day of the run
+START_TIMESTAMP = 1672567200  # 2023-01-01 10:00 UTC
+TARGET_USER_ID = 1
+TARGET_USER_NAME = 'Иван Петров'
+VK_MESSAGES_PER_PAGE = 50
+VK_MONTHS = ['янв', 'фев', 'мар', 'апр', 'мая', 'июн', 'июл', 'авг', 'сен', 'окт', 'ноя', 'дек']
+# strftime formats of every supported whatsapp dialect
+WHATSAPP_DIALECTS = [
+    '[%d.%m.%Y, %H:%M:%S] ',
+    '%d.%m.%Y, %H:%M - ',
+    '%m/%d/%y, %H:%M - ',
+    '[%d.%m.%y, %H:%M:%S] ',
+    '[%d-%m-%Y, %H:%M:%S] ',
+]
+TEXTS = [
+    'привет',
+    'hi there https://example.com/path ok',
+    'lol 😀😀 👍🏻',
+    'see http://www.example.org and https://example.net',
+    'флаг 🇷🇺 ❤️ #️⃣',
+    'a longer message that goes on for a while ' * 5,
+    'ok',
+    '',
+]
+WHATSAPP_CONTENTS = [
+    'hello',
+    'image omitted',
+    'video omitted',
+    'audio omitted',
+    'Missed voice call',
+    'Video call, 3 min',
+    'report.pdf https://example.com/doc',
+    'multi\nline\ntext 😀',
+    '<attached: 00000012-VIDEO.mp4>',
+    'изображение отсутствует',
+    'ok 👍🏻',
+]
+# gaps between consecutive messages, zero makes messages that get merged
+TIME_STEPS = [0, 1, 5, 60, 3600, 86400]
+
+
+def split_messages(messages, chats):
+    per_chat = max(1, messages // chats)
+    return [per_chat + (1 if chat < messages - per_chat * chats else 0) for chat in range(chats)]
+
+
+def is_group_chat(chat, group_share):
+    # spreads the group chats evenly over the export
+    return int((chat + 1) * group_share) > int(chat * group_share)
+
+
+def can_encode(text, encoding):
+    try:
+        text.encode(encoding)
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+# windows-1251 has no emoji, vk exports keep them as images
+VK_TEXTS = [text for text in TEXTS if can_encode(text, 'windows-1251')]
+
+
+def generate_telegram(path, messages=10000, chats=20, group_share=0.25, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n "about": "synthetic export",\n "personal_information": ')
+        f.write(json.dumps({'user_id': TARGET_USER_ID, 'first_name': 'Иван', 'last_name': 'Петров'}, ensure_ascii=False))
+        f.write(',\n "chats": {\n  "about": "chats",\n  "list": [')
+        for chat, count in enumerate(split_messages(messages, chats)):
+            group = is_group_chat(chat, group_share)
+            chat_id = 1000 + chat
+            authors = [(TARGET_USER_ID, 'Иван Петров'), (100 + chat, f'Partner {chat}')]
+            if group:
+                authors += [(200 + chat, f'Member {chat}'), (300 + chat, f'Guest {chat}')]
+            f.write(',\n' if chat else '\n')
+            f.write(f'   {{"name": "Partner {chat}", "type": "{"private_group" if group else "personal_chat"}", '
+                    f'"id": {chat_id}, "messages": [')
+            timestamp = START_TIMESTAMP + chat * 600
+            for number in range(count):
+                timestamp += rng.choice(TIME_STEPS)
+                user_id, name = rng.choice(authors)
+                message = {'id': number, 'type': 'message', 'date_unixtime': str(timestamp), 'from': name,
+                           'from_id': f'user{user_id}'}
+                kind = rng.random()
+                if kind < 0.1:
+                    message['photo'] = 'photos/photo.jpg'
+                elif kind < 0.15:
+                    message.update({'media_type': 'voice_message', 'duration_seconds': rng.randint(1, 60)})
+                elif kind < 0.18:
+                    message.update({'media_type': 'video_message', 'duration_seconds': rng.randint(1, 60)})
+                elif kind < 0.2:
+                    message['media_type'] = 'video_file'
+                elif kind < 0.22:
+                    message = {'id': number, 'type': 'service', 'date_unixtime': str(timestamp), 'actor': name,
+                               'actor_id': f'user{user_id}', 'action': 'phone_call', 'duration_seconds': 60}
+                elif kind < 0.25:
+                    message.update({'media_type': 'sticker', 'sticker_emoji': '😀'})
+                if rng.random() < 0.6:
+                    message['text'] = rng.choice(TEXTS)
+                else:
+                    message['text'] = [rng.choice(TEXTS), {'type': 'link', 'text': 'https://t.me/channel'},
+                                       {'type': 'text_link', 'text': 'here', 'href': 'https://example.com'}]
+                if rng.random() < 0.05:
+                    message['forwarded_from'] = 'Channel'
+                f.write(',\n    ' if number else '\n    ')
+                f.write(json.dumps(message, ensure_ascii=False))
+            f.write('\n   ]}')
+        f.write('\n  ]\n }\n}\n')
+    return messages
+
+
+def format_vk_date(timestamp):
+    local = time.localtime(timestamp)
+    return f'{local.tm_mday} {VK_MONTHS[local.tm_mon - 1]} {local.tm_year} в {local.tm_hour}:{local.tm_min:02d}:{local.tm_sec:02d}'
+
+
+def generate_vk_message(rng, chat, number, timestamp, group):
+    author = rng.random()
+    date = format_vk_date(timestamp)
+    if group and author < 0.3:
+        header = f'<a href="https://vk.com/id{900 + int(author * 10)}">Member {int(author * 10)}</a>, {date}'
+    elif author < 0.5:
+        header = f'Вы, {date}'
+    else:
+        header = f'<a href="https://vk.com/id{300 + chat}">Friend {chat}</a>, {date}'
+    if rng.random() < 0.05:
+        header += ' (ред.)'
+    kind = rng.random()
+    attachment = ''
+    if kind < 0.1:
+        attachment = '<div class="attachment"><div class="attachment__description">Фотография</div>' \
+                     '<a class="attachment__link" href="https://vk.com/photo1_1">photo</a></div>'
+    elif kind < 0.15:
+        attachment = '<div class="attachment"><div class="attachment__description">Видеозапись</div></div>'
+    elif kind < 0.2:
+        attachment = '<div class="attachment"><div class="attachment__description">Аудиозапись</div>' \
+                     '<a class="attachment__link" href="https://vk.com/audio.ogg">audio</a></div>'
+    elif kind < 0.23:
+        attachment = '<div class="attachment"><div class="attachment__description">Звонок</div></div>'
+    elif kind < 0.26:
+        attachment = '<div class="attachment"><div class="attachment__description">Стикер</div></div>'
+    elif kind < 0.3:
+        attachment = '<div class="attachment"><div class="attachment__description">1 прикреплённое сообщение</div></div>'
+    text = rng.choice(VK_TEXTS)
+    if rng.random() < 0.2:
+        text += '<br>second &amp; line'
+    return f'<div class="item"><div class="item__main"><div class="message" data-id="{number}">' \
+           f'<div class="message__header">{header}</div><div>{text}<div class="kludges">{attachment}</div></div>' \
+           f'</div></div></div>\n'
+
+
+def generate_vk(folder, messages=10000, chats=20, group_share=0.25, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(folder, 'profile'), exist_ok=True)
+    os.makedirs(os.path.join(folder, 'messages'), exist_ok=True)
+    with open(os.path.join(folder, 'profile', 'page-info.html'), 'w', encoding='windows-1251') as f:
+        f.write('<html><body><div class="item"><div class="item__tertiary">Полное имя</div>'
+                f'<div>{TARGET_USER_NAME}</div></div></body></html>')
+    index = []
+    for chat, count in enumerate(split_messages(messages, chats)):
+        group = is_group_chat(chat, group_share)
+        chat_id = str(2000000000 + chat if group else 200000 + chat)
+        chat_folder = os.path.join(folder, 'messages', chat_id)
+        os.makedirs(chat_folder, exist_ok=True)
+        index.append(f'<div class="item"><a href="{chat_id}/messages0.html">Chat {chat}</a></div>')
+        timestamp = START_TIMESTAMP + chat * 600
+        pages = (count + VK_MESSAGES_PER_PAGE - 1) // VK_MESSAGES_PER_PAGE
+        # messages0.html holds the newest messages, every page is in chronological order
+        for page in range(pages - 1, -1, -1):
+            page_count = min(VK_MESSAGES_PER_PAGE, count - (pages - 1 - page) * VK_MESSAGES_PER_PAGE)
+            body = []
+            for number in range(page_count):
+                timestamp += rng.choice(TIME_STEPS)
+                body.append(generate_vk_message(rng, chat, number, timestamp, group))
+            with open(os.path.join(chat_folder, f'messages{page * VK_MESSAGES_PER_PAGE}.html'), 'w',
+                      encoding='windows-1251') as f:
+                f.write('<html><head><meta charset="windows-1251"></head><body><div class="wrap">')
+                f.write(''.join(body))
+                f.write('</div></body></html>')
+    with open(os.path.join(folder, 'messages', 'index-messages.html'), 'w', encoding='windows-1251') as f:
+        f.write('<html><body>' + ''.join(index) + '</body></html>')
+    return messages
+
+
+def generate_whatsapp(folder, messages=10000, chats=20, group_share=0.25, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for chat, count in enumerate(split_messages(messages, chats)):
+        dialect = WHATSAPP_DIALECTS[chat % len(WHATSAPP_DIALECTS)]
+        names = ['Alice', 'Bob'] + (['Carl', 'Dana'] if is_group_chat(chat, group_share) else [])
+        timestamp = START_TIMESTAMP + chat * 600
+        separator = '\r\n' if chat % 2 else '\n'
+        with open(os.path.join(folder, f'chat{chat}.txt'), 'w', encoding='utf-8', newline='') as f:
+            for number in range(count):
+                timestamp += rng.choice(TIME_STEPS)
+                prefix = time.strftime(dialect, time.localtime(timestamp))
+                if dialect.startswith('%m/%d/%y'):
+                    # single-digit month and day of this dialect
+                    month, day, rest = prefix.split('/', 2)
+                    prefix = f'{int(month)}/{int(day)}/{rest}'
+                if number == 0:
+                    line = prefix + 'Messages and calls are end-to-end encrypted.'
+                else:
+                    mark = '‎' if rng.random() < 0.1 else ''
+                    line = mark + prefix + rng.choice(names) + ': ' + rng.choice(WHATSAPP_CONTENTS)
+                f.write(line.replace('\n', separator) + separator)
+    return messages
+
+
+GENERATORS = {
+    'telegram': (generate_telegram, 'result.json'),
+    'vk': (generate_vk, 'vk'),
+    'whatsapp': (generate_whatsapp, 'whatsapp'),
+}
+
+
+def generate(platform, folder, messages=10000, chats=20, group_share=0.25, seed=1):
+    # returns the export path the processor of the platform takes
+    generator, name = GENERATORS[platform]
+    path = os.path.join(folder, name)
+    generator(path, messages, chats, group_share, seed)
+    return path
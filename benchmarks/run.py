@@ -0,0 +1,196 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform as platform_info
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # windows, peak rss isn't reported there
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generators import GENERATORS, TARGET_USER_ID, generate
+from cli import get_input_size
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+PARAMETERS_FILE = 'benchmark.json'
+
+
+def get_peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def measure(platform, input_path, output_path, workers, memory_budget=None):
+    # runs in a process of its own, so the peak rss belongs to this platform alone
+    from platforms import get_processor
+    from sinks import write_result
+
+    stages = {}
+    start_time = time.perf_counter()
+    processor = get_processor(platform, input_path, TARGET_USER_ID, lambda value: None, workers, (None, None))
+    if memory_budget is not None:
+        processor.set_output(memory_budget=memory_budget)
+    processor.run()
+    stages['process'] = {'seconds': time.perf_counter() - start_time, 'peak_rss': get_peak_rss()}
+    start_time = time.perf_counter()
+    write_result(processor.result_builder, output_path)
+    stages['write'] = {'seconds': time.perf_counter() - start_time, 'peak_rss': get_peak_rss()}
+    processor.result_builder.close()
+    return {
+        'rows': processor.result_builder.rows_count(),
+        'chats': processor.all_chats,
+        'skipped_chats': processor.skipped_chats,
+        'stages': stages,
+        'stats': processor.stats.to_dict(),
+    }
+
+
+def prepare_export(platform, data_folder, parameters):
+    # a data folder is reused while it was generated with the same parameters
+    folder = os.path.join(data_folder, platform)
+    parameters_path = os.path.join(folder, PARAMETERS_FILE)
+    export_path = os.path.join(folder, GENERATORS[platform][1])
+    if os.path.exists(parameters_path):
+        with open(parameters_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == parameters:
+                return export_path, 0.0
+        shutil.rmtree(folder)
+    start_time = time.perf_counter()
+    generate(platform, folder, parameters['messages'], parameters['chats'], parameters['group_share'], parameters['seed'])
+    with open(parameters_path, 'w', encoding='utf-8') as f:
+        json.dump(parameters, f)
+    return export_path, time.perf_counter() - start_time
+
+
+def run_benchmark(platform, data_folder, parameters, workers, memory_budget=None, log=print):
+    export_path, generation_time = prepare_export(platform, data_folder, parameters)
+    if generation_time:
+        log(f"{platform}: generated {parameters['messages']} messages in {generation_time:.2f} sec")
+    output_path = os.path.join(data_folder, platform, 'processed.csv')
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        measurement = executor.submit(measure, platform, export_path, output_path, workers, memory_budget).result()
+
+    input_bytes = get_input_size(export_path)
+    for stage in measurement['stages'].values():
+        stage['messages_per_second'] = round(parameters['messages'] / stage['seconds'], 1) if stage['seconds'] else 0.0
+        stage['mb_per_second'] = round(input_bytes / stage['seconds'] / 2 ** 20, 2) if stage['seconds'] else 0.0
+        stage['seconds'] = round(stage['seconds'], 3)
+    process_stage = measurement['stages']['process']
+    return dict(parameters, **{
+        'platform': platform,
+        'commit': get_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform_info.python_version(),
+        'machine': platform_info.machine(),
+        'workers': workers,
+        'memory_budget': memory_budget,
+        'input_bytes': input_bytes,
+        'rows': measurement['rows'],
+        'chats_processed': measurement['chats'],
+        'skipped_chats': measurement['skipped_chats'],
+        'messages_per_second': process_stage['messages_per_second'],
+        'mb_per_second': process_stage['mb_per_second'],
+        'peak_rss': measurement['stages']['write']['peak_rss'],
+        'stages': measurement['stages'],
+        'stats': measurement['stats'],
+    })
+
+
+def format_rss(value):
+    return '-' if value is None else f'{value / 2 ** 20:.1f} MB'
+
+
+def format_result(result):
+    stages = ', '.join(f"{name} {stage['seconds']:.2f} sec" for name, stage in result['stages'].items())
+    return (f"{result['platform']}: {result['messages']} messages, {result['input_bytes'] / 2 ** 20:.1f} MB, "
+            f"{result['messages_per_second']} messages/sec, {result['mb_per_second']} MB/sec, "
+            f"peak rss {format_rss(result['peak_rss'])} ({stages})")
+
+
+def read_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(results, log=print):
+    # the latest run of every commit, per platform and benchmark size
+    latest = {}
+    for result in results:
+        key = (result['platform'], result['messages'], result['chats'], result['workers'])
+        latest.setdefault(key, {})[result['commit']] = result
+    for (platform, messages, chats, workers), by_commit in sorted(latest.items()):
+        log(f"{platform}, {messages} messages in {chats} chats, {workers} workers:")
+        for commit, result in by_commit.items():
+            log(f"  {commit or 'unknown':>10} {result['date']}  {result['messages_per_second']:>10} messages/sec "
+                f"{result['mb_per_second']:>8} MB/sec  peak rss {format_rss(result['peak_rss'])}")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the processors on synthetic exports")
+    parser.add_argument('--platforms', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS))
+    parser.add_argument('--messages', type=int, default=100000, help="messages per platform")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--group-share', type=float, default=0.25, help="share of group chats, most of them get skipped")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1, help="chat worker processes, 0 uses all cores")
+    parser.add_argument('--memory-budget', type=int, help="MB of results kept in memory before they are spilled to disk, "
+                                                          "by default the one of the GUI")
+    parser.add_argument('--data', help="folder for the generated exports, kept between runs; a temporary one by default")
+    parser.add_argument('--results', default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument('--no-save', action='store_true', help="don't append the results")
+    parser.add_argument('--compare', action='store_true', help="only print the stored results per commit")
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.compare:
+        compare_results(read_results(args.results))
+        return 0
+
+    parameters = {'messages': args.messages, 'chats': args.chats, 'group_share': args.group_share, 'seed': args.seed}
+    data_folder = args.data or tempfile.mkdtemp(prefix='message-processor-benchmark-')
+    try:
+        results = []
+        for platform in args.platforms:
+            memory_budget = args.memory_budget << 20 if args.memory_budget is not None else None
+            result = run_benchmark(platform, data_folder, parameters, args.workers, memory_budget)
+            print(format_result(result))
+            results.append(result)
+    finally:
+        if not args.data:
+            shutil.rmtree(data_folder, ignore_errors=True)
+    if not args.no_save:
+        with open(args.results, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
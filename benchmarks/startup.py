@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import platform as platform_info
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import get_commit
+from utils import Platform
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_results.jsonl')
+# the window module, then the processor of every platform once it is selected
+TARGETS = {
+    'window': 'import main',
+    Platform.TELEGRAM: f"from platforms import get_processor_class; get_processor_class('{Platform.TELEGRAM}')",
+    Platform.WHATSAPP: f"from platforms import get_processor_class; get_processor_class('{Platform.WHATSAPP}')",
+    Platform.VK: f"from platforms import get_processor_class; get_processor_class('{Platform.VK}')",
+}
+
+
+def measure(statement):
+    # a fresh interpreter every time, nothing is imported yet. Returns the import and the whole process seconds
+    code = f"import time\nstart_time = time.perf_counter()\n{statement}\nprint(time.perf_counter() - start_time)"
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1]), time.perf_counter() - start_time
+
+
+def run_startup_benchmark(target, repeat):
+    measurements = [measure(TARGETS[target]) for _ in range(repeat)]
+    return {
+        'target': target,
+        'commit': get_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform_info.python_version(),
+        'machine': platform_info.machine(),
+        'repeat': repeat,
+        'import_seconds': round(statistics.median(value for value, _ in measurements), 4),
+        'process_seconds': round(statistics.median(value for _, value in measurements), 4),
+    }
+
+
+def format_result(result):
+    return (f"{result['target']}: import {result['import_seconds'] * 1000:.0f} ms, "
+            f"process {result['process_seconds'] * 1000:.0f} ms (median of {result['repeat']})")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the window and the platform processors")
+    parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument('--repeat', type=int, default=5, help="runs per target, the median is reported")
+    parser.add_argument('--results', default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument('--no-save', action='store_true', help="don't append the results")
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    results = []
+    for target in args.targets:
+        result = run_startup_benchmark(target, max(1, args.repeat))
+        print(format_result(result))
+        results.append(result)
+    if not args.no_save:
+        with open(args.results, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
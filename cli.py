@@ -0,0 +1,233 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from data_extractor import get_default_time_window
+from identities import Identities
+from manifest import Manifest, get_manifest_path
+from platforms import get_processor, get_reader
+from sinks import SINKS, get_output_format, open_sink
+from utils import Platform, convert_size
+
+
+def get_input_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(folder, filename))
+    return size
+
+
+def parse_date(value, end_of_day=False):
+    if not value:
+        return None
+    date = datetime.fromisoformat(value)
+    if end_of_day and len(value) == len('YYYY-MM-DD'):
+        # an end date without a time includes that whole day, the window end itself is inclusive
+        return int((date + timedelta(days=1)).timestamp()) - 1
+    return int(date.timestamp())
+
+
+def get_time_window(since=None, until=None):
+    # dates are local, "all" as since processes the whole history instead of the default years
+    if since == 'all':
+        start = None
+    else:
+        start = parse_date(since) or get_default_time_window()[0]
+    return start, parse_date(until, end_of_day=True)
+
+
+def run_job(platform, input_path, user_id, output_path, workers=0, output_format=None, time_window=None,
+            incremental=False, legacy_message_types=False, profile_path=None, identities_path=None, default_start=False,
+            log=print):
+    # default_start tells that the window start is the default one and not a --since date
+    output_format = get_output_format(output_path, output_format)
+    log(f"Processing {platform} export {input_path} for user {user_id}")
+    start_time = time.perf_counter()
+    data = get_reader(platform)(input_path)
+    manifest = None
+    if incremental:
+        manifest = Manifest(get_manifest_path(output_path), {'platform': platform, 'user_id': str(user_id)})
+        if default_start:
+            time_window = manifest.keep_default_start(time_window or get_time_window())
+    processor = get_processor(platform, data, user_id, lambda value: None, workers, time_window)
+    if manifest is not None:
+        processor.set_manifest(manifest)
+    if profile_path:
+        processor.set_profile(profile_path)
+    identities = None
+    if identities_path:
+        identities = Identities(identities_path)
+        processor.set_identities(identities)
+    # results go to a temporary file next to the output, a failed or interrupted job leaves no partial output.
+    # It keeps the extensions of the output, they choose the compression
+    folder, filename = os.path.split(output_path)
+    temp_path = os.path.join(folder, '.tmp-' + filename)
+    sink = open_sink(temp_path, output_format)
+    processor.set_output(sink, legacy_message_types)
+    try:
+        try:
+            processor.run()
+        finally:
+            sink.close()
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    processing_time = time.perf_counter() - start_time
+    if manifest is not None:
+        manifest.save()
+    if identities is not None:
+        identities.save()
+    total_time = time.perf_counter() - start_time
+
+    input_size = get_input_size(input_path)
+    rows = processor.result_builder.rows_count()
+    report = {
+        'platform': platform,
+        'input': input_path,
+        'output': output_path,
+        'user_id': user_id,
+        'rows': rows,
+        'chats': processor.all_chats,
+        'skipped_chats': processor.skipped_chats,
+        'skipped_chat_ids': processor.skipped_chat_ids,
+        'reused_chats': manifest.reused_chats if manifest is not None else 0,
+        'resumed_chats': manifest.resumed_chats if manifest is not None else 0,
+        'input_bytes': input_size,
+        'processing_seconds': round(processing_time, 3),
+        'total_seconds': round(total_time, 3),
+        'rows_per_second': round(rows / processing_time, 1) if processing_time else 0.0,
+        'bytes_per_second': round(input_size / processing_time, 1) if processing_time else 0.0,
+        'stats': processor.stats.to_dict(),
+    }
+    log(f"Processed chats: {report['chats']}, skipped chats: {report['skipped_chats']}, rows: {rows}")
+    if manifest is not None:
+        log(f"Reused chats: {report['reused_chats']}, resumed chats: {report['resumed_chats']}")
+    log(f"Execution time: {processing_time:.2f} sec processing, {total_time:.2f} sec total, "
+        f"{report['rows_per_second']} rows/sec, {convert_size(int(report['bytes_per_second']))}/sec")
+    for line in processor.stats.format_lines():
+        log(line)
+    if profile_path:
+        log(f"Profile saved at {profile_path}")
+    log(f"File saved at {output_path}")
+    return report
+
+
+def get_summary(reports, total_time):
+    succeeded = [report for report in reports if report['status'] == 'ok']
+    return {
+        'jobs': len(reports),
+        'succeeded': len(succeeded),
+        'failed': len(reports) - len(succeeded),
+        'rows': sum(report['rows'] for report in succeeded),
+        'chats': sum(report['chats'] for report in succeeded),
+        'skipped_chats': sum(report['skipped_chats'] for report in succeeded),
+        'input_bytes': sum(report['input_bytes'] for report in succeeded),
+        'total_seconds': round(total_time, 3),
+        'reports': reports,
+    }
+
+
+def read_jobs(path):
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                jobs.append(json.loads(line))
+    return jobs
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Process messenger exports without the GUI")
+    parser.add_argument('--platform', choices=[Platform.TELEGRAM, Platform.WHATSAPP, Platform.VK])
+    parser.add_argument('--input', help="result.json for telegram, export folder for vk and whatsapp, "
+                                               "or a zip archive of the export")
+    parser.add_argument('--user-id')
+    parser.add_argument('--output', help="path of the processed table")
+    parser.add_argument('--format', choices=sorted(SINKS), help="output format, by default taken from the output extension, "
+                                                                "csv and json are compressed for .gz, .bz2 and .xz paths, "
+                                                                "parquet and arrow need pyarrow")
+    parser.add_argument('--workers', type=int, default=0, help="chat worker processes, 0 uses all cores")
+    parser.add_argument('--since', help="first processed date (YYYY-MM-DD[THH:MM]), by default five years back, 'all' for everything")
+    parser.add_argument('--until', help="last processed date (YYYY-MM-DD[THH:MM]), a date without a time includes "
+                                             "that whole day, by default up to now")
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep a manifest next to the output and only process chats changed since the previous run")
+    parser.add_argument('--legacy-message-types', action='store_true',
+                        help="write message_type as the old string codes instead of small integers")
+    parser.add_argument('--identities', help="JSON file that keeps the ids given to whatsapp nicknames and chats, "
+                                             "so they stay the same between exports; one file per account")
+    parser.add_argument('--jobs', help="JSON lines file with platform, input, user_id, output and optional workers, format, "
+                                       "since, until, incremental, legacy_message_types, profile and identities per job")
+    parser.add_argument('--parallel-jobs', type=int, default=1,
+                        help="jobs of --jobs run at the same time, each in a worker process of its own")
+    parser.add_argument('--memory-limit', type=int, help="MB the jobs running at the same time may take together, "
+                                                         "estimated from the size of their exports")
+    parser.add_argument('--retries', type=int, default=1, help="times a failed job of --jobs is run again")
+    parser.add_argument('--report', help="write the summary with the per-job reports to this JSON file")
+    parser.add_argument('--profile', help="dump a cProfile of the processing to this file, chats in worker processes "
+                                          "aren't profiled, use --workers 1 for the whole run")
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.jobs:
+        jobs = read_jobs(args.jobs)
+    elif args.platform and args.input and args.user_id and args.output:
+        jobs = [{'platform': args.platform, 'input': args.input, 'user_id': args.user_id, 'output': args.output,
+                 'profile': args.profile}]
+    else:
+        parser.error("either --jobs or --platform, --input, --user-id and --output are required")
+
+    # chats of a job are spread over all cores unless several jobs share them
+    default_workers = args.workers if args.parallel_jobs == 1 else 1
+    options = [{
+        'platform': job['platform'],
+        'input_path': job['input'],
+        'user_id': job['user_id'],
+        'output_path': job['output'],
+        'workers': job.get('workers', default_workers),
+        'output_format': job.get('format', args.format),
+        'time_window': get_time_window(job.get('since', args.since), job.get('until', args.until)),
+        'incremental': job.get('incremental', args.incremental),
+        'legacy_message_types': job.get('legacy_message_types', args.legacy_message_types),
+        'profile_path': job.get('profile'),
+        'identities_path': job.get('identities', args.identities),
+        'default_start': job.get('since', args.since) is None,
+    } for job in jobs]
+
+    start_time = time.perf_counter()
+    if args.jobs:
+        # imported here, the batch runner uses run_job of this module
+        from batch import run_batch
+        memory_limit = args.memory_limit << 20 if args.memory_limit else None
+        reports = run_batch(options, max(1, args.parallel_jobs), memory_limit, args.retries)
+    else:
+        reports = [dict(run_job(**options[0]), status='ok', attempts=1)]
+    summary = get_summary(reports, time.perf_counter() - start_time)
+    if len(reports) > 1:
+        print(f"Jobs: {summary['jobs']}, succeeded: {summary['succeeded']}, failed: {summary['failed']}, "
+              f"rows: {summary['rows']}, execution time: {summary['total_seconds']:.2f} sec")
+        for report in reports:
+            if report['status'] != 'ok':
+                print(f"Failed: {report['platform']} {report['input']}: {report['error'].splitlines()[0]}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,22 +1,110 @@
 from datetime import datetime, timedelta
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from time import perf_counter
 
+import numpy as np
+
+from text_metrics import count_emoji_column, count_links_column, count_symbols_column
 from utils import PLATFORM_TO_ID
 
 MESSAGES_COUNT_TO_CONTINUE = 3000
+TIME_WINDOW_DAYS = 5 * 365
+SKIP_THREE_AUTHORS = 'three_authors'
+# columns of the collected messages, in the order of the result table
+MESSAGE_COLUMNS = ('active_user_nickname', 'active_user_id', 'timestamp', 'message_type', 'symbols_count',
+                   'picture_count', 'emoji_count', 'link_count', 'video_count', 'seconds_count', 'is_forwarded')
+SKIP_NO_TARGET_MESSAGES = 'no_target_messages'
+# summed when consecutive messages of the same timestamp and type are merged, the first message keeps the rest
+MERGED_COLUMNS = ('picture_count', 'video_count', 'seconds_count')
+
+
+def get_default_time_window():
+    # (start, end) unix timestamps of the processed messages, None leaves that side open. The start is a midnight,
+    # so every run of a day has the same window and incremental runs can reuse the chats
+    start = datetime.now() - timedelta(days=TIME_WINDOW_DAYS)
+    return int(datetime(start.year, start.month, start.day).timestamp()), None
+
+
+def in_time_window(timestamp, time_window):
+    start, end = time_window
+    return (start is None or timestamp >= start) and (end is None or timestamp <= end)
+
+
+class ChatScreen:
+    # the skip rules of MessageProcessor.process on authors and timestamps only, without feature extraction.
+    # A message with the timestamp of the previous one may be merged into it, when the types can't tell it is only
+    # counted towards the target bound, so a skip is reported only when the processing would stop the chat too
+    def __init__(self, target_user_id, messages_count_to_continue=MESSAGES_COUNT_TO_CONTINUE):
+        self.target_user_id = target_user_id
+        self.messages_count_to_continue = messages_count_to_continue
+        self.prev_timestamp = 0
+        self.prev_message_type = None
+        self.authors = set()
+        self.messages_count = 0
+        self.target_messages_count = 0
+        self.skip_reason = None
+
+    def add(self, active_user_id, timestamp, message_type=None):
+        if timestamp != self.prev_timestamp:
+            appended = True
+        elif message_type is None or self.prev_message_type is None:
+            appended = None
+        else:
+            appended = message_type != self.prev_message_type
+        self.prev_timestamp = timestamp
+        if appended is None:
+            self.prev_message_type = None
+            self.target_messages_count += int(active_user_id == self.target_user_id)
+        elif appended:
+            self.prev_message_type = message_type
+            self.target_messages_count += int(active_user_id == self.target_user_id)
+            self.messages_count += 1
+            self.authors.add(active_user_id)
+        return self.need_skip()
+
+    def need_skip(self):
+        if len(self.authors) >= 3:
+            self.skip_reason = SKIP_THREE_AUTHORS
+        elif self.messages_count_to_continue is not None and self.target_messages_count == 0 \
+                and self.messages_count > self.messages_count_to_continue:
+            self.skip_reason = SKIP_NO_TARGET_MESSAGES
+        return self.skip_reason is not None
+
 
 class MessageProcessor(ABC):
-    def __init__(self, user_id_mapper):
+    # what process carries from one message to the next besides the collected data
+    state_fields = ('count_target_user_messages', 'count_all_messages', 'continue_processing', 'prev_date_unixtime')
+
+    def __init__(self, user_id_mapper, time_window=None):
         self.context = {}
         self.data = defaultdict(list)
-        self.need_append_message = True
-        self.time_border = int((datetime.now() - timedelta(days=5 * 365)).timestamp())
+        # rows before it are merged already, a resumed chat starts with the rows of the previous run
+        self.coalesced_rows = 0
+        self.time_window = time_window or get_default_time_window()
         self.user_id_mapper = user_id_mapper
         self.continue_processing = True
         self.count_target_user_messages = 0
         self.count_all_messages = 0
         self.unique_active_user_id = set()
+        self.skip_reason = None
+        # instrumentation, read by the processor once the chat is done
+        self.messages_seen = 0
+        self.messages_filtered = 0
+        self.messages_merged = 0
+        self.collect_seconds = 0.0
+
+    def get_state(self):
+        state = {field: getattr(self, field) for field in self.state_fields}
+        state['unique_active_user_id'] = list(self.unique_active_user_id)
+        return state
+
+    def set_state(self, state, data):
+        for field in self.state_fields:
+            setattr(self, field, state[field])
+        self.unique_active_user_id = set(state['unique_active_user_id'])
+        self.data = defaultdict(list, {key: list(values) for key, values in data.items()})
+        self.coalesced_rows = len(self.data['timestamp'])
 
     def get_or_else(self, one, another):
         if one in self.message:
@@ -26,29 +114,92 @@ class MessageProcessor(ABC):
 
     def process(self, message):
         self.message = message
-        if not self.need_process_message() or self.time_border > self.get_timestamp():
+        self.messages_seen += 1
+        if not self.need_process_message() or not in_time_window(self.get_timestamp(), self.time_window):
+            self.messages_filtered += 1
             return
+        start_time = perf_counter()
         self.update_aggregated_chat_info()
-        if self.need_append_message:
-            active_user_id = self.get_active_user_id()
-            self.data['active_user_nickname'].append(self.get_active_user_nickname())
-            self.data['active_user_id'].append(active_user_id)
-            self.data['timestamp'].append(self.get_timestamp())
-            self.data['message_type'].append(self.get_message_type())
-            self.data['symbols_count'].append(self.get_symbols_count())
-            self.data['picture_count'].append(self.get_picture_count())
-            self.data['emoji_count'].append(self.get_emoji_count())
-            self.data['link_count'].append(self.get_link_count())
-            self.data['video_count'].append(self.get_video_count())
-            self.data['seconds_count'].append(self.get_seconds_count())
-            self.data['is_forwarded'].append(self.get_is_forwarded())
+        # every message gets a row, the ones merged into the previous row are dropped by coalesce_messages.
+        # They aren't counted, the skip rules see the chat as it will be after the merge
+        timestamp = self.get_timestamp()
+        message_type = self.get_message_type()
+        merged = timestamp == self.prev_date_unixtime and message_type == self.data['message_type'][-1]
+        active_user_id = self.get_active_user_id()
+        self.data['active_user_nickname'].append(self.get_active_user_nickname())
+        self.data['active_user_id'].append(active_user_id)
+        self.data['timestamp'].append(timestamp)
+        self.data['message_type'].append(message_type)
+        self.data['picture_count'].append(self.get_picture_count())
+        self.collect_text()
+        self.data['video_count'].append(self.get_video_count())
+        self.data['seconds_count'].append(self.get_seconds_count())
+        self.data['is_forwarded'].append(self.get_is_forwarded())
+        self.prev_date_unixtime = timestamp
+        if merged:
+            self.messages_merged += 1
+        else:
             if active_user_id == self.get_target_used_id():
                 self.count_target_user_messages += 1
             self.count_all_messages += 1
             self.unique_active_user_id.add(active_user_id)
-        if (self.count_all_messages > MESSAGES_COUNT_TO_CONTINUE and self.count_target_user_messages == 0) or len(self.unique_active_user_id) >= 3:
+        self.collect_seconds += perf_counter() - start_time
+        if len(self.unique_active_user_id) >= 3:
             self.continue_processing = False
+            self.skip_reason = SKIP_THREE_AUTHORS
+        elif self.count_all_messages > MESSAGES_COUNT_TO_CONTINUE and self.count_target_user_messages == 0:
+            self.continue_processing = False
+            self.skip_reason = SKIP_NO_TARGET_MESSAGES
+
+    def coalesce_messages(self):
+        # merges the runs of rows with the same timestamp and message type into their first row, the last row
+        # of a resumed chat may take the first new messages. Returns the rows of the collected text columns that
+        # are kept, None when nothing is merged
+        rows_count = len(self.data['timestamp'])
+        start = max(self.coalesced_rows - 1, 0)
+        collected_start = self.coalesced_rows
+        self.coalesced_rows = rows_count
+        if rows_count - start < 2:
+            return None
+        timestamps = np.asarray(self.data['timestamp'][start:])
+        message_types = np.asarray(self.data['message_type'][start:])
+        run_starts = np.empty(len(timestamps), dtype=bool)
+        run_starts[0] = True
+        run_starts[1:] = (timestamps[1:] != timestamps[:-1]) | (message_types[1:] != message_types[:-1])
+        heads = np.flatnonzero(run_starts)
+        if len(heads) == len(run_starts):
+            return None
+        head_rows = (heads + start).tolist()
+        collected_rows = [row - collected_start for row in head_rows if row >= collected_start]
+        for key, values in self.data.items():
+            if key in MERGED_COLUMNS:
+                values[start:] = np.add.reduceat(np.asarray(values[start:]), heads).tolist()
+            elif key not in MESSAGE_COLUMNS:
+                # collected for the rows since the previous run only, like the texts
+                values[:] = [values[row] for row in collected_rows]
+            elif len(values) == rows_count:
+                values[start:] = [values[row] for row in head_rows]
+        self.coalesced_rows = len(self.data['timestamp'])
+        return collected_rows
+
+    def collect_text(self):
+        # the text counts are computed for all messages of the chat at once by count_text_features
+        self.data['text'].append(self.get_message_text())
+
+    def count_text_features(self):
+        texts = self.data.pop('text', None)
+        if not texts:
+            return
+        self.add_text_features(count_symbols_column(texts), count_links_column(texts), count_emoji_column(texts))
 
+    def add_text_features(self, symbols_counts, link_counts, emoji_counts):
+        # a resumed chat already has the counts of its earlier messages
+        self.data['symbols_count'].extend(symbols_counts)
+        self.data['link_count'].extend(link_counts)
+        self.data['emoji_count'].extend(emoji_counts)
+        order = {key: index for index, key in enumerate(MESSAGE_COLUMNS)}
+        keys = sorted(self.data, key=lambda key: order.get(key, len(order)))
+        self.data = defaultdict(list, {key: self.data[key] for key in keys})
 
     @abstractmethod
     def update_aggregated_chat_info(self):
@@ -82,20 +233,12 @@ class MessageProcessor(ABC):
     def get_message_type(self):
         pass
 
-    @abstractmethod
-    def get_symbols_count(self):
-        pass
-
     @abstractmethod
     def get_picture_count(self):
         pass
 
     @abstractmethod
-    def get_emoji_count(self):
-        pass
-
-    @abstractmethod
-    def get_link_count(self):
+    def get_message_text(self):
         pass
 
     @abstractmethod
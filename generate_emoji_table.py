@@ -0,0 +1,45 @@
+import os
+import sys
+
+import emoji
+
+# emoji_table.py is generated by this script at build time, so the emoji package isn't needed when running
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emoji_table.py')
+RANGES_PER_LINE = 4
+
+
+def get_emoji_ranges(emoji_data):
+    # [start, end) ranges of the emoji that are a single codepoint, the sequences are made of them
+    ranges = []
+    for codepoint in sorted(ord(value) for value in emoji_data if len(value) == 1):
+        if ranges and ranges[-1][1] == codepoint:
+            ranges[-1][1] = codepoint + 1
+        else:
+            ranges.append([codepoint, codepoint + 1])
+    return ranges
+
+
+def format_table(ranges, version):
+    lines = [
+        f"# generated by generate_emoji_table.py from emoji {version}, don't edit",
+        "# [start, end) codepoint ranges of the single codepoint emoji",
+        "EMOJI_RANGES = (",
+    ]
+    for index in range(0, len(ranges), RANGES_PER_LINE):
+        items = ' '.join(f'(0x{start:x}, 0x{end:x}),' for start, end in ranges[index:index + RANGES_PER_LINE])
+        lines.append(f"    {items}")
+    lines.append(")")
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else TABLE_PATH
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(format_table(get_emoji_ranges(emoji.EMOJI_DATA), emoji.__version__))
+    print(f"Emoji table written to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+IDENTITIES_VERSION = 1
+# ids stay below 2 ** 53, so they are exact in readers that load numbers as floats, spreadsheets among them
+ID_BITS = 53
+
+
+def get_keyed_id(namespace, value):
+    # the namespace keys the hash, the same nickname gets unrelated ids as a user and as a chat
+    digest = hashlib.blake2b(value.encode(), digest_size=8, key=namespace.encode()).digest()
+    return int.from_bytes(digest, 'big') >> (64 - ID_BITS)
+
+
+class IdentityTable:
+    def __init__(self, namespace, ids=None):
+        self.namespace = namespace
+        self.ids = dict(ids or {})
+        self.values = {value_id: value for value, value_id in self.ids.items()}
+        # assigned since the last drain, sent back from pool workers with the chat
+        self.added = {}
+        self.collisions = 0
+
+    def get_id(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.add(value)
+        return value_id
+
+    def add(self, value, value_id=None):
+        if value_id is None:
+            value_id = get_keyed_id(self.namespace, value)
+        while self.values.get(value_id, value) != value:
+            # taken by another value, the next free id is used and kept in the table for the later runs
+            self.collisions += 1
+            value_id = (value_id + 1) % (1 << ID_BITS)
+        self.ids[value] = value_id
+        self.values[value_id] = value
+        self.added[value] = value_id
+        return value_id
+
+    def drain(self):
+        added = self.added
+        self.added = {}
+        return added
+
+
+class Identities:
+    # stable integer ids of nicknames and chat names per namespace, every distinct value is hashed once.
+    # With a path the ids are kept between runs, so they don't change from one export to the next
+    def __init__(self, path=None):
+        self.path = path
+        self.tables = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+            if content.get('version') == IDENTITIES_VERSION:
+                for namespace, ids in content['namespaces'].items():
+                    self.tables[namespace] = IdentityTable(namespace, ids)
+
+    def get_table(self, namespace):
+        table = self.tables.get(namespace)
+        if table is None:
+            table = IdentityTable(namespace)
+            self.tables[namespace] = table
+        return table
+
+    def drain(self):
+        return {namespace: table.drain() for namespace, table in self.tables.items() if table.added}
+
+    def merge(self, added):
+        # ids assigned by pool workers, a collision between two workers is only resolved for the later runs
+        for namespace, ids in added.items():
+            table = self.get_table(namespace)
+            for value, value_id in ids.items():
+                if value not in table.ids:
+                    table.add(value, value_id)
+
+    def get_collisions(self):
+        return sum(table.collisions for table in self.tables.values())
+
+    def save(self):
+        content = {
+            'version': IDENTITIES_VERSION,
+            'namespaces': {namespace: table.ids for namespace, table in self.tables.items()},
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,91 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# chats listed in the slowest chats of a run
+SLOWEST_CHATS = 5
+
+
+class Stats:
+    # stage seconds are exclusive, a nested stage is taken out of the one around it so they add up to the total
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.skip_reasons = defaultdict(int)
+        self.chats = []
+        self.stages = []
+
+    @contextmanager
+    def timer(self, stage):
+        start_time = time.perf_counter()
+        self.stages.append(stage)
+        try:
+            yield
+        finally:
+            self.stages.pop()
+            self.add_time(stage, time.perf_counter() - start_time)
+
+    def add_time(self, stage, seconds):
+        self.seconds[stage] += seconds
+        if self.stages:
+            self.seconds[self.stages[-1]] -= seconds
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def add_chat(self, chat_id, seconds, messages, skip_reason=None):
+        self.chats.append((seconds, chat_id, messages, skip_reason))
+        if skip_reason is not None:
+            self.skip_reasons[skip_reason] += 1
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for reason, value in other.skip_reasons.items():
+            self.skip_reasons[reason] += value
+        self.chats.extend(other.chats)
+
+    def __getstate__(self):
+        # sent back from pool workers once the chat is done
+        state = self.__dict__.copy()
+        state['stages'] = []
+        return state
+
+    def to_dict(self, slowest=SLOWEST_CHATS):
+        return {
+            'seconds': {stage: round(seconds, 4) for stage, seconds in sorted(self.seconds.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'skip_reasons': dict(sorted(self.skip_reasons.items())),
+            'slowest_chats': [
+                {'chat_id': chat_id, 'seconds': round(seconds, 4), 'messages': messages, 'skip_reason': skip_reason}
+                for seconds, chat_id, messages, skip_reason in sorted(self.chats, key=lambda chat: -chat[0])[:slowest]
+            ],
+        }
+
+    def format_lines(self, slowest=SLOWEST_CHATS):
+        stats = self.to_dict(slowest)
+        lines = ["Stages: " + ", ".join(f"{stage} {seconds:.2f} sec" for stage, seconds in stats['seconds'].items())]
+        lines.append("Counters: " + ", ".join(f"{name} {value}" for name, value in stats['counters'].items()))
+        if stats['skip_reasons']:
+            lines.append("Skip reasons: " + ", ".join(f"{reason} {value}" for reason, value in stats['skip_reasons'].items()))
+        for chat in stats['slowest_chats']:
+            skipped = f", skipped: {chat['skip_reason']}" if chat['skip_reason'] else ""
+            lines.append(f"Slow chat {chat['chat_id']}: {chat['seconds']:.2f} sec, {chat['messages']} messages{skipped}")
+        return lines
+
+
+# stats the readers report to, the processor swaps in a fresh one for every chat
+active = Stats()
+
+
+def get_active():
+    return active
+
+
+def set_active(stats):
+    global active
+    previous = active
+    active = stats
+    return previous
@@ -0,0 +1,119 @@
+import codecs
+import json
+import os
+
+from instrumentation import get_active
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+# a number followed by one of them was cut at the end of the buffer, like 0.|75 or 1e|5
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JsonStream:
+    def __init__(self, file, chunk_size=CHUNK_SIZE, size=None):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self.size = size
+        if size is None:
+            try:
+                self.size = os.fstat(file.fileno()).st_size
+            except (AttributeError, OSError):
+                self.size = 0
+
+    def progress(self):
+        if self.size == 0:
+            return 0.0
+        return min(1.0, self.bytes_read / self.size)
+
+    def fill(self, min_size=0):
+        if self.eof:
+            return False
+        stats = get_active()
+        with stats.timer('read'):
+            raw = self.file.read(max(self.chunk_size, min_size))
+        self.bytes_read += len(raw)
+        stats.count('bytes_read', len(raw))
+        if not raw:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(raw, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                cut = isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and (end >= len(self.buffer) - 1 or self.buffer[end] in NUMBER_CHARS)
+                if not cut or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow geometrically so a large value is decoded a bounded number of times
+            self.fill(len(self.buffer) - self.pos)
+
+    def iter_object(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.pos - 1)
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buffer, self.pos - 1)
+
+    def skip_value(self):
+        char = self.peek()
+        if char == '{':
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == '[':
+            for _ in self.iter_array():
+                self.skip_value()
+        else:
+            self.read_value()
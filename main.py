@@ -4,46 +4,20 @@ from tkinter import ttk
 from tkinter import filedialog, messagebox
 from tkinter import font
 import os
-from math import log, pow
+import queue
+import threading
 import time
+import traceback
+import multiprocessing
 
-from messangers.tg import TelegramProcessor
-from messangers.vk import VkProcessor
-from messangers.whatsapp import WhatsappProcessor
-from utils import catch_command_errors, read_file, Platform, read_html_file
+from platforms import get_processor, get_reader
+from utils import catch_command_errors, Platform, convert_size
 
+# how often the window picks up the progress of the processing thread
+POLL_INTERVAL_MS = 100
+# chat worker processes of a run, 0 uses all cores
+WORKERS = 0
 
-def convert_size(size_bytes):
-    if size_bytes == 0:
-        return "0B"
-
-    size_name = ("B", "KB", "MB", "GB", "TB", "PB")
-    i = int(min(len(size_name) - 1, (log(size_bytes, 1024))))  # Use math.log
-    p = pow(1024, i)  # Use math.pow
-    s = round(size_bytes / p, 2)
-
-    return f"{s} {size_name[i]}"
-
-
-def get_processor(platform, data, user_id, update_progress):
-    if platform == Platform.TELEGRAM:
-        return TelegramProcessor(data, int(user_id), update_progress)
-    elif platform == Platform.WHATSAPP:
-        return WhatsappProcessor(data, int(user_id), update_progress)
-    elif platform == Platform.VK:
-        return VkProcessor(data, int(user_id), update_progress)
-    else:
-        raise Exception(f"Unknown platform: {platform}\n")
-
-def get_reader(platform):
-    if platform == Platform.TELEGRAM:
-        return read_file
-    elif platform == Platform.WHATSAPP:
-        return lambda x: x
-    elif platform == Platform.VK:
-        return lambda x: x
-    else:
-        raise Exception(f"Unknown platform: {platform}\n")
 
 class Application(tk.Frame):
     def __init__(self, master=None):
@@ -55,6 +29,10 @@ class Application(tk.Frame):
         self.create_widgets()
         self.is_uploaded = False
         self.is_user_id_set = False
+        self.processor = None
+        self.worker = None
+        # progress, results and errors of the processing thread, only the main thread touches the widgets
+        self.events = queue.Queue()
         os_type = platform.system()
         if os_type == "Windows":
             self.log.insert(tk.END, "Running on Windows\n")
@@ -64,8 +42,8 @@ class Application(tk.Frame):
             self.log.insert(tk.END, "Running on Linux\n")
 
     def update_progress(self, value):
-        self.progress['value'] = value
-        self.update_idletasks()
+        # called from the processing thread
+        self.events.put(('progress', value))
 
     def create_widgets(self):
         self.selector_label = tk.Label(self, text="Мессенджер: ", font=self.font)
@@ -99,6 +77,10 @@ class Application(tk.Frame):
         self.progress = ttk.Progressbar(self, orient='horizontal', length=400, mode='determinate')
         self.progress.grid(row=2, column=1, sticky='W', padx=10, pady=5)
 
+        self.cancel_button = tk.Button(self, text="Отменить", command=self.cancel, state="disabled", font=self.font,
+                                       height=3, width=20)
+        self.cancel_button.grid(row=2, column=1, sticky='E')
+
         self.log = tk.Text(self, height=20, width=100, font=self.font)
         self.log.grid(row=3, column=0, columnspan=2)
 
@@ -108,10 +90,12 @@ class Application(tk.Frame):
 
     @catch_command_errors("upload_file")
     def upload_file(self):
-        if self.var.get() == Platform.VK or self.var.get() == Platform.WHATSAPP:
+        # exports can be read straight from their zip archive
+        if (self.var.get() == Platform.VK or self.var.get() == Platform.WHATSAPP) \
+                and not messagebox.askyesno("Загрузка", "Экспорт в ZIP-архиве?"):
             filename = filedialog.askdirectory()
         else:
-            filename = filedialog.askopenfilename()
+            filename = filedialog.askopenfilename(filetypes=[("Exports", "*.json *.zip"), ("All files", "*.*")])
             self.log.insert(tk.END, f"Try upload: {filename}\n")
             self.log.insert(tk.END, f"File size: {convert_size(os.path.getsize(filename))}\n")
         self.data = get_reader(self.var.get())(filename)
@@ -135,7 +119,6 @@ class Application(tk.Frame):
 
     @catch_command_errors("process")
     def process(self):
-        self.user_id_entry.config(state=tk.DISABLED)
         platform = self.var.get()
         user_id = self.user_id_entry.get().strip()
         if platform == "":
@@ -145,33 +128,114 @@ class Application(tk.Frame):
             self.log.insert(tk.END, "User ID is not specified\n")
             return
         self.log.insert(tk.END, f"Processing for platform: {platform} with User ID: {user_id}\n")
-        self.download_button.config(state="normal")
+        if self.processor is not None:
+            # the results of the previous run may be spilled to temporary files
+            self.processor.result_builder.close()
+        self.processor = get_processor(platform, self.data, user_id, self.update_progress, WORKERS)
+        self.progress['value'] = 0
+        self.set_running(True)
+        self.worker = threading.Thread(target=self.run_processor, args=(self.processor,), daemon=True)
+        self.worker.start()
+        self.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def run_processor(self, processor):
+        # runs in the processing thread, the results are posted to the window
         start_time = time.time()
-        self.processor = get_processor(platform, self.data, user_id, self.update_progress)
-        self.processor.run()
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+        try:
+            processor.run()
+        except Exception as e:
+            self.events.put(('error', (repr(e), traceback.format_exc())))
+            return
+        self.events.put(('done', time.time() - start_time))
+
+    def poll_events(self):
+        try:
+            while True:
+                event, value = self.events.get_nowait()
+                if event == 'progress':
+                    self.progress['value'] = value
+                elif event == 'done':
+                    self.finish_processing(value)
+                elif event == 'error':
+                    self.fail_processing(*value)
+        except queue.Empty:
+            pass
+        if self.worker is not None:
+            self.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def set_running(self, running):
+        state = tk.DISABLED if running else tk.NORMAL
+        for widget in (self.process_button, self.upload_button, self.selector, self.user_id_entry):
+            widget.config(state=state)
+        self.cancel_button.config(state=tk.NORMAL if running else tk.DISABLED)
+        if running:
+            self.download_button.config(state=tk.DISABLED)
+
+    def cancel(self):
+        if self.processor is not None:
+            self.processor.cancel()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.log.insert(tk.END, "Cancelling, the chat in progress is finished first\n")
+
+    def finish_processing(self, elapsed_time):
+        self.worker = None
+        self.set_running(False)
         minutes = int(elapsed_time // 60)
         seconds = int(elapsed_time % 60)
+        if self.processor.cancelled:
+            self.log.insert(tk.END, "Processing cancelled, the results of the processed chats can be downloaded\n")
         self.log.insert(tk.END, f"Execution time: {minutes} min {seconds} sec\n")
         self.log.insert(tk.END, f"Processed chats: {self.processor.all_chats}, skipped chats: {self.processor.skipped_chats}, skipped chat ids: {self.processor.skipped_chat_ids}\n")
+        for line in self.processor.stats.format_lines():
+            self.log.insert(tk.END, line + "\n")
+        if self.processor.result_builder.rows_count():
+            self.download_button.config(state="normal")
+        self.log.see(tk.END)
+
+    def fail_processing(self, error, trace):
+        # unlike the other commands the window stays usable, the export can be processed again
+        self.worker = None
+        self.set_running(False)
+        self.show_error("process", error, trace)
+
+    def show_error(self, command_name, error, trace):
+        self.log.insert(tk.END, f"Error while executing: {command_name}\n")
+        self.log.insert(tk.END, f"{error}\n")
+        self.log.insert(tk.END, f"{trace}\n")
+        self.log.see(tk.END)
 
-    @catch_command_errors("download")
     def download(self):
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
-        )
+        # a failed save keeps the window usable too, the result can be saved again
+        try:
+            self.save_result()
+        except Exception as e:
+            self.show_error("download", repr(e), traceback.format_exc())
+            return
+        self.log.insert(tk.END, "download: OK\n\n")
+
+    def save_result(self):
+        # pandas is only loaded with the processors, not while the window starts
+        from sinks import import_pyarrow, write_result
+        filetypes = [("CSV files", "*.csv"), ("Compressed CSV files", "*.csv.gz")]
+        try:
+            import_pyarrow()
+            filetypes += [("Parquet files", "*.parquet"), ("Arrow files", "*.arrow")]
+        except Exception:
+            pass
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=filetypes + [("All files", "*.*")])
         if file_path:
-            self.processor.processed.to_csv(file_path, index=False)
+            write_result(self.processor.result_builder, file_path)
             self.log.insert(tk.END, f"File saved at {file_path}\n")
+            self.log.see(tk.END)
 
-root = tk.Tk()
-root.title("Message processor")
-app = Application(master=root)
-app.mainloop()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    root = tk.Tk()
+    root.title("Message processor")
+    app = Application(master=root)
+    app.mainloop()
 
-# data = read_file("/home/vladimir/Git/message-processor/result.json")
+# data = "/home/vladimir/Git/message-processor/result.json"
 # processor = TelegramProcessor(data, 1)
 # processor.run()
 # processor.processed.to_csv('processed.csv', index=False)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import uuid
+
+MANIFEST_VERSION = 3
+
+
+def get_manifest_path(output_path):
+    return output_path + '.manifest.json'
+
+
+def get_columns_folder(manifest_path):
+    return os.path.splitext(manifest_path)[0] + '.columns'
+
+
+def read_columns(path):
+    # the columns of a previous run are kept on disk, None for a skipped chat
+    if path is None:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def window_allows_reuse(entry, time_window):
+    # a chat result stays valid while the window still lets through every message it was built from
+    old_start, old_end = entry['time_window']
+    start, end = time_window
+    if old_end != end:
+        return False
+    if old_start == start:
+        return True
+    if entry['columns_file'] is None or start is None or (old_start is not None and start < old_start):
+        return False
+    return entry['first_timestamp'] is None or entry['first_timestamp'] >= start
+
+
+class Manifest:
+    def __init__(self, path, settings):
+        self.path = path
+        # platform and target user, results of other settings are never reused
+        self.settings = settings
+        # only fingerprints and offsets are kept in memory, the columns of every chat are in a file of their own
+        self.columns_folder = get_columns_folder(path)
+        # files of this run never replace the ones the saved manifest points at
+        self.run_id = uuid.uuid4().hex[:8]
+        self.previous = {}
+        # window start of the runs without --since, kept from the first of them
+        self.previous_default_start = None
+        self.default_start = None
+        self.chats = {}
+        self.reused_chats = 0
+        self.resumed_chats = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+            if content.get('version') == MANIFEST_VERSION and content.get('settings') == settings:
+                self.previous = content['chats']
+                self.previous_default_start = content.get('default_start')
+
+    def keep_default_start(self, time_window):
+        # the default start moves a day forward every day, which would invalidate every chat older than it.
+        # Runs without --since keep the start of the first one, so their chats stay reusable
+        if self.previous_default_start is not None:
+            time_window = (self.previous_default_start, time_window[1])
+        self.default_start = time_window[0]
+        return time_window
+
+    def get_columns_path(self, entry):
+        if entry['columns_file'] is None:
+            return None
+        return os.path.join(self.columns_folder, entry['columns_file'])
+
+    def get_previous(self, key):
+        entry = self.previous.get(key)
+        if entry is None:
+            return None
+        # read in the pool worker that resumes the chat
+        return dict(entry, columns_path=self.get_columns_path(entry))
+
+    def write_columns(self, key, columns):
+        if columns is None:
+            return None
+        os.makedirs(self.columns_folder, exist_ok=True)
+        name = f"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}-{self.run_id}.json"
+        with open(os.path.join(self.columns_folder, name), 'w', encoding='utf-8') as f:
+            json.dump(columns, f, ensure_ascii=False)
+        return name
+
+    def update(self, chat_info, columns, entry):
+        if entry.get('reused'):
+            chat_id = entry['chat_id']
+            entry = self.previous[entry['key']]
+            chat_info = dict(entry['chat_info'], chat_id=chat_id)
+            columns = read_columns(self.get_columns_path(entry))
+            entry['chat_info'] = chat_info
+            self.reused_chats += 1
+        else:
+            if entry.pop('resumed', False):
+                self.resumed_chats += 1
+            entry['chat_info'] = chat_info
+            entry['columns_file'] = self.write_columns(entry['key'], columns)
+        self.chats[entry['key']] = entry
+        return chat_info, columns
+
+    def save(self):
+        # chats missing from the new export are dropped with their rows
+        content = {
+            'version': MANIFEST_VERSION,
+            'settings': self.settings,
+            'default_start': self.default_start,
+            'chats': self.chats,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        # the files of the previous run that the new manifest doesn't point at
+        if os.path.isdir(self.columns_folder):
+            kept = {entry['columns_file'] for entry in self.chats.values()}
+            for name in os.listdir(self.columns_folder):
+                if name not in kept:
+                    os.remove(os.path.join(self.columns_folder, name))
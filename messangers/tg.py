@@ -1,18 +1,20 @@
-import re
+import hashlib
 import json
 
-import emoji
-import pandas as pd
-
-from data_extractor import MessageProcessor
+from archives import get_size, open_file
+from data_extractor import ChatScreen, MessageProcessor, in_time_window
+from instrumentation import get_active
+from json_stream import JsonStream
 from processors import Processor
+from text_metrics import count_emoji, count_emoji_column, count_links, count_links_column, count_symbols_column
 from utils import MessageType, DEFAULT_VALUE, Platform, DEFAULT_VALUE_NUM
 
 
 class TelegramMessageProcessor(MessageProcessor):
-    def __init__(self, user_id_mapper):
-        super().__init__(user_id_mapper)
+    def __init__(self, user_id_mapper, time_window=None):
+        super().__init__(user_id_mapper, time_window)
         self.prev_date_unixtime = 0
+        self.text_extras = {}
 
     def get_timestamp(self):
         return int(self.message['date_unixtime'])
@@ -27,76 +29,60 @@ class TelegramMessageProcessor(MessageProcessor):
         else:
             return MessageType.MESSAGE
 
-    def get_symbols_count(self):
-        return self.message_structure['symbols_count']
-
     def get_picture_count(self):
         return 1 if len(self.message.get('photo', '')) > 0 else 0
 
-    def get_emoji_count(self):
-        return self.message_structure['emoji_count']
-
-    def get_link_count(self):
-        return self.message_structure['links_count']
-
     def get_seconds_count(self):
         return self.message.get('duration_seconds', 0)
 
     def get_video_count(self):
         return 1 if self.message.get('media_type', '') == 'video_file' else 0
 
-    def count_aggregates(self):
-        def count_links(text):
-            url_pattern = r'(https?://(?:www\.)?[^\s]+)'
-            links = re.findall(url_pattern, text)
-            return len(links)
-
-        def count_symbols(text):
-            return len(text)
-
-        def count_emoji(text):
-            emoji_list = [char for char in text if char in emoji.EMOJI_DATA]
-            return len(emoji_list)
+    def get_message_text(self):
+        return self.message['text']
 
+    def collect_text(self):
+        # the parts of a formatted text are joined with spaces, which neither a link nor an emoji sequence crosses,
+        # so only the symbols count has to take the spaces back. Hrefs and sticker emoji are rare, they are kept by row
         message_text = self.message['text']
+        row = len(self.data['text'])
         if isinstance(message_text, str):
-            return {
-                "symbols_count": count_symbols(message_text),
-                "links_count": count_links(message_text),
-                "emoji_count": count_emoji(message_text) + count_emoji(self.message.get('sticker_emoji', ''))
-            }
-        elif isinstance(message_text, list):
-            symbols_count = 0
-            links_count = 0
-            emoji_count = 0
-            for item in message_text:
-                if isinstance(item, dict):
-                    text = item.get("text", "")
-                    symbols_count += count_symbols(text)
-                    links_count += count_links(text) + count_links(item.get("href", ""))
-                    emoji_count += count_emoji(text)
-                else:
-                    symbols_count += count_symbols(item)
-                    links_count += count_links(item)
-                    emoji_count += count_emoji(item)
-            return {
-                "symbols_count": symbols_count,
-                "links_count": links_count,
-                "emoji_count": emoji_count
-            }
+            self.data['text'].append(message_text)
+            sticker_emoji = self.message.get('sticker_emoji')
+            if sticker_emoji:
+                self.text_extras[row] = (0, '', sticker_emoji)
         else:
-            raise Exception("failed to parse message:" + str(self.message))
+            parts = [item.get('text', '') if isinstance(item, dict) else item for item in message_text]
+            self.data['text'].append(' '.join(parts))
+            link_text = ' '.join(item.get('href', '') for item in message_text if isinstance(item, dict))
+            if len(parts) > 1 or link_text:
+                self.text_extras[row] = (max(len(parts) - 1, 0), link_text, '')
+
+    def coalesce_messages(self):
+        collected_rows = super().coalesce_messages()
+        if collected_rows is not None and self.text_extras:
+            positions = {row: position for position, row in enumerate(collected_rows)}
+            self.text_extras = {positions[row]: extras for row, extras in self.text_extras.items() if row in positions}
+        return collected_rows
+
+    def count_text_features(self):
+        texts = self.data.pop('text', None)
+        text_extras = self.text_extras
+        self.text_extras = {}
+        if not texts:
+            return
+        symbols_counts = count_symbols_column(texts)
+        link_counts = count_links_column(texts)
+        emoji_counts = count_emoji_column(texts)
+        for row, (separators_count, link_text, sticker_emoji) in text_extras.items():
+            symbols_counts[row] -= separators_count
+            link_counts[row] += count_links(link_text)
+            emoji_counts[row] += count_emoji(sticker_emoji)
+        self.add_text_features(symbols_counts, link_counts, emoji_counts)
 
     def update_aggregated_chat_info(self):
-        self.message_structure = self.count_aggregates()
-        if self.get_timestamp() == self.prev_date_unixtime and self.get_message_type() == self.data['message_type'][-1]:
-            self.need_append_message = False
-            self.data['picture_count'][-1] += self.get_picture_count()
-            self.data['video_count'][-1] += self.get_video_count()
-            self.data['seconds_count'][-1] += self.get_seconds_count()
-        else:
-            self.need_append_message = True
-            self.prev_date_unixtime = self.get_timestamp()
+        if not isinstance(self.message['text'], (str, list)):
+            raise Exception("failed to parse message:" + str(self.message))
 
     def get_target_used_id(self):
         for value in self.user_id_mapper.values():
@@ -119,24 +105,70 @@ class TelegramMessageProcessor(MessageProcessor):
         return self.message.get('forwarded_from', DEFAULT_VALUE) != DEFAULT_VALUE
 
 
+def read_chat(stream, keep_message):
+    chat = {}
+    for key in stream.iter_object():
+        if key == 'messages':
+            chat[key] = []
+            for _ in stream.iter_array():
+                message = stream.read_value()
+                if keep_message(message):
+                    chat[key].append(message)
+        else:
+            chat[key] = stream.read_value()
+    return chat
+
+
+def iter_export(stream, keep_message=None):
+    for key in stream.iter_object():
+        if key == 'personal_information':
+            yield key, stream.read_value()
+        elif key == 'chats':
+            for chats_key in stream.iter_object():
+                if chats_key == 'list':
+                    for _ in stream.iter_array():
+                        with get_active().timer('parse'):
+                            chat = stream.read_value() if keep_message is None else read_chat(stream, keep_message)
+                        yield 'chat', chat
+                else:
+                    stream.skip_value()
+        else:
+            stream.skip_value()
+
+
 class TelegramProcessor(Processor):
-    def __init__(self, data, custom_target_user_id, update_progress):
-        super().__init__(Platform.TELEGRAM, custom_target_user_id, update_progress)
-        self.data = data
+    # chats are sent to pool workers directly, the export itself stays in the parent
+    worker_excluded_fields = Processor.worker_excluded_fields + ('data',)
 
-    def parse(self):
-        parsed_json = json.loads(self.data)
-        return parsed_json
+    def __init__(self, data, custom_target_user_id, update_progress, workers=1, time_window=None):
+        super().__init__(Platform.TELEGRAM, custom_target_user_id, update_progress, workers, time_window)
+        # path to result.json, the export is streamed from it
+        self.data = data
 
     def run(self):
-        data = self.parse()
-        personal_info = data['personal_information']
+        with open_file(self.data) as f:
+            stream = JsonStream(f, size=get_size(self.data))
+            events = iter_export(stream, self.keep_message)
+            key, personal_info = next(events, (None, None))
+            if key != 'personal_information':
+                raise Exception("personal_information must precede chats in: " + self.data)
+            self.set_personal_info(personal_info)
+            chats = (chat for _, chat in events)
+            self.process_chats(chats, lambda processed_num: stream.progress())
+
+    def keep_message(self, message):
+        # messages outside the time window are dropped while the chat is read, process would skip them anyway
+        try:
+            return in_time_window(int(message['date_unixtime']), self.time_window)
+        except (KeyError, TypeError, ValueError):
+            return True
+
+    def set_personal_info(self, personal_info):
         self.context.update({
             'target_used_id': personal_info['user_id'],
             'nickname': personal_info['first_name'] + ' ' + personal_info['last_name']
         })
         self.user_id_mapper = {personal_info['user_id']: self.custom_target_user_id}
-        self.process_chats(data['chats']['list'])
 
     def start_process_chat(self, chat):
         self.chat_info = {
@@ -149,14 +181,36 @@ class TelegramProcessor(Processor):
         else:
             self.chat_info['partner_used_id'] = DEFAULT_VALUE_NUM
             self.chat_info['partner_user_nickname'] = DEFAULT_VALUE
-        return TelegramMessageProcessor(self.user_id_mapper)
+        return TelegramMessageProcessor(self.user_id_mapper, self.time_window)
+
+    def screen_chat(self, chat):
+        # personal chats are hardly ever skipped, only the other ones are worth a look before processing
+        if self.chat_info['chat_users_count'] == 2:
+            return False
+        processor = self.message_processor
+        screen = ChatScreen(processor.get_target_used_id())
+        try:
+            for message in chat['messages']:
+                processor.message = message
+                if not processor.need_process_message() or not in_time_window(processor.get_timestamp(), self.time_window):
+                    continue
+                if not isinstance(message['text'], (str, list)):
+                    return False
+                if screen.add(processor.get_active_user_id(), processor.get_timestamp(), processor.get_message_type()):
+                    processor.skip_reason = screen.skip_reason
+                    return True
+        except Exception:
+            # broken messages are left to the processing to report
+            return False
+        return False
+
+    def get_chat_fingerprint(self, chat):
+        return hashlib.blake2b(json.dumps(chat, ensure_ascii=False).encode(), digest_size=16).hexdigest()
 
     def finish_process_chat(self):
         messages = self.message_processor.data
         if len(messages) == 0:
-            return pd.DataFrame()
+            return self.chat_info, messages
         if self.chat_info['chat_users_count'] == -1:
             self.chat_info['chat_users_count'] = len(set(messages['active_user_id']))
-        data = {key: [value] * len(next(iter(messages.values()))) for key, value in self.chat_info.items()}
-        data.update(messages)
-        return pd.DataFrame(data)
\ No newline at end of file
+        return self.chat_info, messages
\ No newline at end of file
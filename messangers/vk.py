@@ -1,114 +1,201 @@
-import glob
-import os
 import re
-from datetime import datetime
+from functools import lru_cache
 
-import emoji
+import numpy as np
 import pandas as pd
 
-from data_extractor import MessageProcessor
+from archives import glob_files, open_file
+from data_extractor import ChatScreen, MessageProcessor, in_time_window
+from instrumentation import get_active
 from processors import Processor
-from utils import Platform, read_html_file, DEFAULT_TARGET_USER_NAME, MessageType, DEFAULT_VALUE_NUM, DEFAULT_VALUE
+from text_metrics import count_emoji_column, count_links_column, count_symbols_column
+from utils import Platform, read_html_file, DEFAULT_TARGET_USER_NAME, MessageType, DEFAULT_VALUE_NUM, DEFAULT_VALUE, \
+    TIMESTAMP_CACHE_SIZE, get_minute_timestamp, get_file_hash
 from bs4 import BeautifulSoup
+from lxml import etree, html
+
+VK_HTML_PARSER = html.HTMLParser(encoding='windows-1251')
+MESSAGE_XPATH = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' message ')]")
+DATE_REGEX = re.compile(r'(\d{1,2} [а-яё]+ \d{4} в \d{1,2}:\d{2}):(\d{2})')
+DATE_PREFIX_REGEX = re.compile(r'(\d{1,2}) ([а-яё]+) (\d{4}) в (\d{1,2}):(\d{2})')
+# header-only scan of a page used to screen chats before they are parsed
+HEADER_SCAN_REGEX = re.compile(r'<div class="message__header">(.*?)</div>', re.S)
+AUTHOR_HREF_REGEX = re.compile(r'<a href="([^"]*)"')
+TAG_REGEX = re.compile(r'<[^>]*>')
+MONTHS = {
+    'янв': 1,
+    'фев': 2,
+    'мар': 3,
+    'апр': 4,
+    'май': 5,
+    'мая': 5,
+    'июн': 6,
+    'июл': 7,
+    'авг': 8,
+    'сен': 9,
+    'окт': 10,
+    'ноя': 11,
+    'дек': 12
+}
+
+
+def has_class(element, class_name):
+    return class_name in (element.get('class') or '').split()
+
+
+def get_inner_html(div):
+    # text nodes and serialized non-div children, the same text html.parser contents joined to
+    parts = [div.text or '']
+    for child in div:
+        if child.tag is etree.Comment:
+            parts.append(child.text or '')
+        elif child.tag != 'div':
+            parts.append(etree.tostring(child, encoding=str, method='xml', with_tail=False))
+        parts.append(child.tail or '')
+    return ''.join(parts).strip()
+
+
+def extract_message(message):
+    header = None
+    attachments = []
+    attachment_link_href = None
+    for element in message.iter('div', 'a'):
+        if element.tag == 'div':
+            if header is None and has_class(element, 'message__header'):
+                header = element
+            elif has_class(element, 'attachment__description'):
+                attachments.append(element.text_content())
+        elif attachment_link_href is None and has_class(element, 'attachment__link'):
+            attachment_link_href = element.get('href', '')
+
+    record = {
+        'header': header.text_content(),
+        'author_href': None,
+        'author_nickname': None,
+        'text': '',
+        'attachments': attachments,
+        'attachment_link_href': attachment_link_href,
+    }
+    author = next(header.iter('a'), None)
+    if author is not None:
+        record['author_href'] = author.get('href')
+        record['author_nickname'] = author.text_content()
+    text_div = header.getnext()
+    while text_div is not None and text_div.tag != 'div':
+        text_div = text_div.getnext()
+    if text_div is not None:
+        record['text'] = get_inner_html(text_div)
+    return record
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def get_date_prefix_timestamp(date_prefix):
+    day, month, year, hour, minute = DATE_PREFIX_REGEX.fullmatch(date_prefix).groups()
+    if month not in MONTHS:
+        raise ValueError(f"unknown month: {month}")
+    return get_minute_timestamp(year, MONTHS[month], day, hour, minute)
+
+
+def parse_timestamps(headers):
+    # "29 апр 2022 в 20:31" prefixes repeat across a page, each distinct one is converted once
+    prefixes = []
+    seconds = []
+    for header in headers:
+        match = DATE_REGEX.search(header.split(', ')[-1])
+        if match is None:
+            raise Exception(f"Error: couldn't match date pattern in: {header}")
+        prefixes.append(match.group(1))
+        seconds.append(match.group(2))
+    codes, unique_prefixes = pd.factorize(pd.Series(prefixes, dtype=object))
+    minute_timestamps = []
+    for prefix in unique_prefixes:
+        try:
+            minute_timestamps.append(get_date_prefix_timestamp(prefix))
+        except ValueError:
+            raise Exception(f"Error: couldn't parse date: {prefix}")
+    seconds = np.array(seconds).astype(np.int64)
+    if (seconds > 59).any():
+        raise Exception(f"Error: couldn't parse date: {prefixes[int((seconds > 59).argmax())]}")
+    return (np.array(minute_timestamps, dtype=np.int64)[codes] + seconds).tolist()
+
+
+def read_page(path):
+    stats = get_active()
+    with stats.timer('read'), open_file(path) as f:
+        page = f.read()
+    stats.count('bytes_read', len(page))
+    return page
+
+
+def parse_messages_page(page):
+    if not page.strip():
+        return []
+    stats = get_active()
+    with stats.timer('parse'):
+        root = html.document_fromstring(page, parser=VK_HTML_PARSER)
+        records = [extract_message(message) for message in MESSAGE_XPATH(root)]
+    if records:
+        with stats.timer('timestamps'):
+            timestamps = parse_timestamps([record['header'] for record in records])
+        for record, timestamp in zip(records, timestamps):
+            record['timestamp'] = timestamp
+    return records
+
+
+def scan_page_headers(page):
+    # (author href, timestamp) per message, None when the page doesn't have the usual export markup
+    page = page.decode('windows-1251', errors='replace')
+    headers = HEADER_SCAN_REGEX.findall(page)
+    if not headers or len(headers) != page.count('class="message"'):
+        return None
+    hrefs = []
+    for header in headers:
+        author = AUTHOR_HREF_REGEX.search(header)
+        hrefs.append(author.group(1) if author else None)
+    timestamps = parse_timestamps([TAG_REGEX.sub('', header) for header in headers])
+    return list(zip(hrefs, timestamps))
+
 
 class VkMessageProcessor(MessageProcessor):
-    def __init__(self, user_id_mapper, target_user_nickname):
-        self.OK = False
-        self.time = None
-        super().__init__(user_id_mapper)
+    def __init__(self, user_id_mapper, target_user_nickname, time_window=None):
+        super().__init__(user_id_mapper, time_window)
         self.target_user_nickname = target_user_nickname
         self.prev_date_unixtime = 0
 
     def get_timestamp(self):
-        if self.time is not None:
-            return self.time
-
-        month_map = {
-            'янв': 'Jan',
-            'фев': 'Feb',
-            'мар': 'Mar',
-            'апр': 'Apr',
-            'май': 'May',
-            'мая': 'May',
-            'июн': 'Jun',
-            'июл': 'Jul',
-            'авг': 'Aug',
-            'сен': 'Sep',
-            'окт': 'Oct',
-            'ноя': 'Nov',
-            'дек': 'Dec'
-        }
-
-        pattern = r'\d{1,2} [а-яё]+ \d{4} в \d{1,2}:\d{2}:\d{2}'
-        header = self.message.find('div', class_='message__header').text
-        date_str = header.split(', ')[-1]
-        match = re.search(pattern, date_str)
-
-        if match:
-            date_part = match.group()
-
-            for ru_month, en_month in month_map.items():
-                if ru_month in date_part:
-                    date_part = date_part.replace(ru_month, en_month).replace(' в ', ' ')
-                    break
-
-            try:
-                dt = datetime.strptime(date_part, "%d %b %Y %H:%M:%S")
-                t = int(dt.timestamp())
-                self.time = t
-                return t
-            except ValueError:
-                raise Exception(f"Error: couldn't parse date: {date_part}")
-        else:
-            raise Exception(f"Error: couldn't match date pattern in: {header}")
+        return self.message['timestamp']
 
+    def get_first_attachment(self):
+        attachments = self.message['attachments']
+        return attachments[0] if attachments else ''
 
     def check_if_call(self):
-        attachment_description = self.message.find('div', class_='attachment__description')
-        if attachment_description and 'Звонок' in attachment_description.text:
-            return True
-        return False
+        return 'Звонок' in self.get_first_attachment()
 
     def check_if_video(self):
-        image_count = 0
-        attachment_descriptions = self.message.find_all('div', class_='attachment__description')
-        for description in attachment_descriptions:
-            if 'Видеозапись' in description.text:
-                image_count += 1
-        return image_count
+        return sum(1 for description in self.message['attachments'] if 'Видеозапись' in description)
 
     def check_if_voice(self):
-        attachment_link = self.message.find('a', class_='attachment__link')
-        if attachment_link and attachment_link['href'].endswith('.ogg'):
-            return True
-        return False
+        href = self.message['attachment_link_href']
+        return href is not None and href.endswith('.ogg')
 
     def get_message_type(self):
+        message_type = self.message.get('message_type')
+        if message_type is not None:
+            return message_type
         if self.check_if_voice():
-            return MessageType.MESSAGE_VOICE
+            message_type = MessageType.MESSAGE_VOICE
         elif self.check_if_video():
-            return MessageType.MESSAGE_VIDEO
+            message_type = MessageType.MESSAGE_VIDEO
         elif self.check_if_call():
-            return MessageType.CALL_AUDIO
+            message_type = MessageType.CALL_AUDIO
         else:
-            return MessageType.MESSAGE
-
-    def get_symbols_count(self):
-        return self.message_structure['symbols_count']
+            message_type = MessageType.MESSAGE
+        self.message['message_type'] = message_type
+        return message_type
 
     def get_picture_count(self):
-        image_count = 0
-        attachment_descriptions = self.message.find_all('div', class_='attachment__description')
-        for description in attachment_descriptions:
-            if 'Фотография' in description.text:
-                image_count += 1
-        return image_count
-
-    def get_emoji_count(self):
-        return self.message_structure['emoji_count']
-
-    def get_link_count(self):
-        return self.message_structure['links_count']
+        return sum(1 for description in self.message['attachments'] if 'Фотография' in description)
 
     def get_seconds_count(self):
         return 0
@@ -117,64 +204,41 @@ class VkMessageProcessor(MessageProcessor):
         return 1 if self.check_if_video() else 0
 
     def check_if_sticker(self):
-        attachment_description = self.message.find('div', class_='attachment__description')
-        if attachment_description and 'Стикер' in attachment_description.text:
-            return True
-        return False
+        return 'Стикер' in self.get_first_attachment()
 
     def get_message_text(self):
-        header_div = self.message.find('div', class_='message__header')
-        message_text_div = header_div.find_next_sibling('div')
-        text_parts = [element for element in message_text_div.contents if element.name != 'div']
-        message_text = ''.join(str(part) for part in text_parts).strip()
-        return message_text
-
-    def count_aggregates(self):
-        def count_links(text):
-            url_pattern = r'(https?://(?:www\.)?[^\s]+)'
-            links = re.findall(url_pattern, text)
-            return len(links)
-
-        def count_symbols(text):
-            return len(text)
-
-        def count_emoji(text):
-            emoji_list = [char for char in text if char in emoji.EMOJI_DATA]
-            return len(emoji_list)
-
-        message_text = self.get_message_text()
-        return {
-            "symbols_count": count_symbols(message_text),
-            "links_count": count_links(message_text),
-            "emoji_count": count_emoji(message_text) + count_emoji(self.message.get('sticker_emoji', '')) + int(self.check_if_sticker())
-        }
+        return self.message['text']
+
+    def collect_text(self):
+        super().collect_text()
+        self.data['sticker'].append(self.check_if_sticker())
+
+    def count_text_features(self):
+        texts = self.data.pop('text', None)
+        stickers = self.data.pop('sticker', None)
+        if not texts:
+            return
+        # a sticker counts as one more emoji
+        emoji_counts = [count + sticker for count, sticker in zip(count_emoji_column(texts), stickers)]
+        self.add_text_features(count_symbols_column(texts), count_links_column(texts), emoji_counts)
 
     def update_aggregated_chat_info(self):
-        self.message_structure = self.count_aggregates()
-        if self.get_timestamp() == self.prev_date_unixtime and self.get_message_type() == self.data['message_type'][-1]:
-            self.need_append_message = False
-            self.data['picture_count'][-1] += self.get_picture_count()
-            self.data['video_count'][-1] += self.get_video_count()
-            self.data['seconds_count'][-1] += self.get_seconds_count()
-        else:
-            self.need_append_message = True
-            self.prev_date_unixtime = self.get_timestamp()
+        pass
 
     def get_target_used_id(self):
         return self.user_id_mapper
 
     def get_active_user_id(self):
-        header = self.message.find('div', class_='message__header')
-        if header.find('a'):
-            href = header.find('a')['href']
+        href = self.message['author_href']
+        if href is not None:
             return int(re.split('event|id|public|club', href)[-1])
         else:
             return self.get_target_used_id()
 
     def get_active_user_nickname(self):
-        header = self.message.find('div', class_='message__header')
-        if header.find('a'):
-            return header.find('a').text
+        nickname = self.message['author_nickname']
+        if nickname is not None:
+            return nickname
         else:
             return self.target_user_nickname
 
@@ -185,15 +249,13 @@ class VkMessageProcessor(MessageProcessor):
         return True
 
     def get_is_forwarded(self):
-        attachment_description = self.message.find('div', class_='attachment__description')
-        if attachment_description and ('прикреплён' in attachment_description.text or 'Запись на стене' in attachment_description.text):
-            return True
-        return False
+        attachment_description = self.get_first_attachment()
+        return 'прикреплён' in attachment_description or 'Запись на стене' in attachment_description
 
 
 class VkProcessor(Processor):
-    def __init__(self, data, custom_target_user_id, update_progress):
-        super().__init__(Platform.VK, custom_target_user_id, update_progress)
+    def __init__(self, data, custom_target_user_id, update_progress, workers=1, time_window=None):
+        super().__init__(Platform.VK, custom_target_user_id, update_progress, workers, time_window)
         self.data = data
 
     def extract_full_name(self):
@@ -233,33 +295,88 @@ class VkProcessor(Processor):
         self.target_user_nickname = self.extract_full_name()
         self.process_chats(self.parse_index())
 
-    def start_process_chat(self, chat):
+    def get_chat_pages(self, chat):
         def extract_number_from_filename(filepath):
             match = re.search(r'messages(\d+)\.html', filepath)
             if match:
                 return int(match.group(1))
             return float('inf')
 
-        def message_generator(chat_folder_path):
-            chat_paths = glob.glob(os.path.join(chat_folder_path, '*.html'))
-            for path in sorted(chat_paths, key=extract_number_from_filename, reverse=True):
-                file_data = read_html_file(path)
-                soup = BeautifulSoup(file_data, 'html.parser')
-                for message in soup.find_all('div', class_='message'):
-                    yield message
+        chat_paths = glob_files(self.data + '/messages/' + chat['id'], '*.html')
+        return sorted(chat_paths, key=extract_number_from_filename, reverse=True)
+
+    def get_chat_fingerprint(self, chat):
+        return [get_file_hash(path) for path in self.get_chat_pages(chat)]
+
+    def start_process_chat(self, chat):
+        def message_generator(chat):
+            # every page is read once, screen_chat may have read the pages up to the first one in the time window
+            first_index, first_page = chat.pop('first_page', (0, None))
+            scanning = True
+            for path in chat['pages'][first_index:]:
+                page = first_page if first_page is not None else read_page(path)
+                first_page = None
+                if scanning:
+                    if not self.page_in_time_window(page):
+                        continue
+                    # pages are oldest first, past the first one in an open ended window all of them are in it
+                    scanning = self.time_window[1] is not None
+                yield from parse_messages_page(page)
 
         self.chat_info = {
             'chat_id': int(chat['id']),
         }
-        chat_folder_path = self.data + '/messages/' + chat['id']
         #if chat['id'] == '2000000151':#'240400996':
-        chat['messages'] = message_generator(chat_folder_path)
-        return VkMessageProcessor(self.user_id_mapper, self.target_user_nickname)
+        chat['pages'] = self.get_chat_pages(chat)
+        chat['messages'] = message_generator(chat)
+        return VkMessageProcessor(self.user_id_mapper, self.target_user_nickname, self.time_window)
+
+    def page_in_time_window(self, page):
+        # pages whose headers are all outside the time window are never parsed
+        try:
+            headers = scan_page_headers(page)
+        except Exception:
+            return True
+        if headers is None:
+            return True
+        return any(in_time_window(timestamp, self.time_window) for _, timestamp in headers)
+
+    def screen_chat(self, chat):
+        # the first page in the time window usually shows whether a chat is a group one, its headers are scanned
+        # without lxml. Attachments aren't looked at, so messages that could be merged are only counted as possible ones
+        if not chat['pages']:
+            return False
+        processor = self.message_processor
+        screen = ChatScreen(processor.get_target_used_id())
+        try:
+            # pages are oldest first, under a time window the first ones may have no messages in it
+            for index, path in enumerate(chat['pages']):
+                page = read_page(path)
+                if self.page_in_time_window(page):
+                    chat['first_page'] = (index, page)
+                    break
+            else:
+                chat['first_page'] = (len(chat['pages']), None)
+                return False
+            headers = scan_page_headers(page)
+            if headers is None:
+                return False
+            for href, timestamp in headers:
+                if not in_time_window(timestamp, self.time_window):
+                    continue
+                processor.message = {'author_href': href}
+                if screen.add(processor.get_active_user_id(), timestamp):
+                    processor.skip_reason = screen.skip_reason
+                    return True
+        except Exception:
+            # broken pages are left to the processing to report
+            return False
+        return False
 
     def finish_process_chat(self):
         messages = self.message_processor.data
         if len(messages) == 0:
-            return pd.DataFrame()
+            return self.chat_info, messages
         self.chat_info['chat_users_count'] = len(set(messages['active_user_id']))
         if self.chat_info['chat_users_count'] == 2:
             self.chat_info['partner_used_id'] = next(iter(set(messages['active_user_id']) - {self.custom_target_user_id}))
@@ -267,6 +384,4 @@ class VkProcessor(Processor):
         else:
             self.chat_info['partner_used_id'] = DEFAULT_VALUE_NUM
             self.chat_info['partner_user_nickname'] = DEFAULT_VALUE
-        data = {key: [value] * len(next(iter(messages.values()))) for key, value in self.chat_info.items()}
-        data.update(messages)
-        return pd.DataFrame(data)
+        return self.chat_info, messages
@@ -1,168 +1,235 @@
-import glob
 import os
 import re
 import json
 from datetime import datetime
+from itertools import chain, islice
+from time import perf_counter
 
-import emoji
 import pandas as pd
 
-from data_extractor import MessageProcessor
+import text_metrics
+from archives import get_size, list_dir, map_file, open_file
+from data_extractor import ChatScreen, MessageProcessor, in_time_window
+from instrumentation import get_active
+from manifest import read_columns
 from processors import Processor
-from utils import MessageType, DEFAULT_VALUE, Platform, DEFAULT_VALUE_NUM, get_hash
+from utils import MessageType, DEFAULT_VALUE, Platform, DEFAULT_VALUE_NUM, get_minute_timestamp, get_file_hash
+
+
+# (header pattern, strptime format of its timestamp group) for every supported export dialect
+DIALECTS = [
+    (r'(\[\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2}:\d{2}\])', '%d.%m.%Y, %H:%M:%S'),  # [dd.mm.yyyy, hh:mm:ss]
+    (r'(\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2}) -', '%d.%m.%Y, %H:%M'),  # dd.mm.yyyy, hh:mm -
+    (r'(\d{1,2}/\d{1,2}/\d{2}, \d{2}:\d{2}) -', '%m/%d/%y, %H:%M'),  # m/d/yy, hh:mm - (allows single-digit month and day)
+    (r'(\[\d{2}\.\d{2}\.\d{2}, \d{2}:\d{2}:\d{2}\])', '%d.%m.%y, %H:%M:%S'),  # [dd.mm.yy, hh:mm:ss]
+    (r'(\[\d{2}-\d{2}-\d{4}, \d{2}:\d{2}:\d{2}\])', '%d-%m-%Y, %H:%M:%S'),  # [dd-mm-yyyy, hh:mm:ss]
+]
+DIALECT_PATTERNS = [re.compile(pattern) for pattern, _ in DIALECTS]
+MESSAGE_START_PATTERN = re.compile('^(?:' + '|'.join(pattern for pattern, _ in DIALECTS) + ')')
+MESSAGE_START_CHARS = '[0123456789'
+DIALECT_SNIFF_LINES = 200
+# messages whose timestamps are converted together while the chat is streamed
+MESSAGES_BATCH_SIZE = 4096
+# exports are chronological, but clock changes can put a message a bit out of order,
+# so reading starts at a header older than the window start by this margin
+SEEK_MARGIN = 24 * 60 * 60
+# lines looked through for the next message header while seeking
+SEEK_LINES = 100
+# records looked at before processing, a group chat shows its third author long before that
+SCREEN_MESSAGES = 1000
+# identity namespaces of the nicknames and the chat file names
+NICKNAME_IDS = 'whatsapp_nickname'
+CHAT_IDS = 'whatsapp_chat'
+NICKNAME_PATTERN = re.compile(r'[\]\-] (.*?):')
+ATTACHED_VIDEO_PATTERN = re.compile(r'<attached:.*\.(mp4|mov)>', re.IGNORECASE)
+MINUTES_PATTERN = re.compile(r'(\d+) min')
+SECONDS_PATTERN = re.compile(r'(\d+) sec')
 
 
 def return_num(ok):
     return 1 if ok else 0
 
 
+def get_message_type(content):
+    if content:
+        if "Voice call" in content or "voice call" in content:
+            return MessageType.CALL_AUDIO
+        elif "Video call" in content or "video call" in content:
+            return MessageType.CALL_VIDEO
+        elif ".opus>" in content or 'audio omitted' == content or 'аудиофайл отсутствует' in content:
+            return MessageType.MESSAGE_VOICE
+        else:
+            return MessageType.MESSAGE
+    return MessageType.CALL_UNDEFINED
+
+
+def get_seconds_count(content):
+    match = MINUTES_PATTERN.search(content) if 'min' in content else None
+    if match:
+        return int(match.group(1)) * 60
+    match = SECONDS_PATTERN.search(content) if 'sec' in content else None
+    if match:
+        return int(match.group(1))
+    return 0
+
+
+def match_message_start(line, dialect=None):
+    if not line or line[0] not in MESSAGE_START_CHARS:
+        return None
+    if dialect is not None:
+        match = DIALECT_PATTERNS[dialect].match(line)
+        if match:
+            return dialect, match.group(1)
+    match = MESSAGE_START_PATTERN.match(line)
+    if match:
+        return match.lastindex - 1, match.group(match.lastindex)
+    return None
+
+
+def detect_dialect(lines):
+    counts = [0] * len(DIALECTS)
+    for line in lines[:DIALECT_SNIFF_LINES]:
+        start = match_message_start(line)
+        if start is not None:
+            counts[start[0]] += 1
+    if max(counts) == 0:
+        return None
+    return counts.index(max(counts))
+
+
+def parse_timestamp(record):
+    dialect, timestamp_str = record['start']
+    try:
+        dt = datetime.strptime(timestamp_str.strip('[]'), DIALECTS[dialect][1])
+    except ValueError as e:
+        record['timestamp_error'] = e
+        return
+    try:
+        record['timestamp'] = int(dt.timestamp())
+    except Exception:
+        record['timestamp'] = 0
+
+
+def parse_timestamps(records, dialect):
+    # one pandas conversion for the chat dialect, strptime only for the records it can't handle
+    batch = [record for record in records if record['start'] is not None and record['start'][0] == dialect]
+    if batch:
+        dates = pd.to_datetime(pd.Series([record['start'][1].strip('[]') for record in batch], dtype=object),
+                               format=DIALECTS[dialect][1], errors='coerce')
+        codes, minutes = pd.factorize(dates.dt.floor('min'))
+        minute_timestamps = []
+        for minute in minutes:
+            try:
+                minute_timestamps.append(get_minute_timestamp(minute.year, minute.month, minute.day, minute.hour, minute.minute))
+            except Exception:
+                minute_timestamps.append(None)
+        seconds = dates.dt.second.to_numpy()
+        for record, code, second in zip(batch, codes, seconds):
+            if code >= 0 and minute_timestamps[code] is not None:
+                record['timestamp'] = minute_timestamps[code] + int(second)
+    for record in records:
+        if record['timestamp'] is None and record['start'] is not None:
+            parse_timestamp(record)
+
+
+def create_record(message, start):
+    return {
+        'message': message,
+        'start': start,
+        'timestamp': None,
+        'timestamp_error': None,
+    }
+
+
+def parse_message(record):
+    message = record['message']
+    nickname = NICKNAME_PATTERN.search(message)
+    record.update({
+        'content': None,
+        'nickname': nickname.group(1) if nickname else DEFAULT_VALUE,
+    })
+    if record['start'] is None:
+        return record
+
+    content = message.partition(': ')[2].replace('\r\n', '').replace('\n', '')
+    message_type = get_message_type(content)
+    picture_count = return_num(content == 'image omitted' or content == 'GIF omitted') \
+        + return_num(".jpg" in content) \
+        + return_num("изображение отсутствует" in content)
+    video_count = return_num('<' in content and ATTACHED_VIDEO_PATTERN.search(content)) \
+        + return_num('video omitted' in content) \
+        + return_num('видео отсутствует' in content)
+    record.update({
+        'content': content,
+        'message_type': message_type,
+        'picture_count': picture_count,
+        'video_count': video_count,
+        'seconds_count': get_seconds_count(content),
+        'is_text': picture_count == 0 and video_count == 0 and message_type == MessageType.MESSAGE,
+    })
+    return record
+
+
 class WhatsappMessageProcessor(MessageProcessor):
-    def __init__(self, user_id_mapper):
-        super().__init__(user_id_mapper)
+    def __init__(self, user_id_mapper, nickname_ids, time_window=None):
+        super().__init__(user_id_mapper, time_window)
+        self.nickname_ids = nickname_ids
         self.prev_date_unixtime = 0
 
-    def sanitize_input(self, text):
-        return ''.join(c for c in text if c.isprintable())
-
     def get_timestamp(self):
-        sanitized_message = self.sanitize_input(self.message)
-
-        patterns_formats = [
-            # [dd-mm-yyyy, hh:mm:ss]
-            (r'^\[?(\d{1,2})-(\d{1,2})-(\d{4}), (\d{2}):(\d{2}):(\d{2})\]?', '%d-%m-%Y, %H:%M:%S'),
-            # [dd.mm.yyyy, hh:mm:ss]
-            (r'^\[?(\d{1,2})\.(\d{1,2})\.(\d{4}), (\d{2}):(\d{2}):(\d{2})\]?', '%d.%m.%Y, %H:%M:%S'),
-            # [dd.mm.yy, hh:mm:ss]
-            (r'^\[?(\d{1,2})\.(\d{1,2})\.(\d{2}), (\d{2}):(\d{2}):(\d{2})\]?', '%d.%m.%y, %H:%M:%S'),
-            # [dd.mm.yyyy, hh:mm]
-            (r'^\[?(\d{1,2})\.(\d{1,2})\.(\d{4}), (\d{2}):(\d{2})\]?', '%d.%m.%Y, %H:%M'),
-            # [dd.mm.yy, hh:mm]
-            (r'^\[?(\d{1,2})\.(\d{1,2})\.(\d{2}), (\d{2}):(\d{2})\]?', '%d.%m.%y, %H:%M'),
-            # [mm/dd/yy, hh:mm]
-            (r'^\[?(\d{1,2})/(\d{1,2})/(\d{2}), (\d{2}):(\d{2})\]?', '%m/%d/%y, %H:%M'),
-        ]
-
-        for pattern, date_format in patterns_formats:
-            match = re.match(pattern, sanitized_message)
-            if match:
-                timestamp_str = match.group(0).strip('[]')
-                dt = datetime.strptime(timestamp_str, date_format)
-                try:
-                    t = int(dt.timestamp())
-                except Exception as e:
-                    t = 0
-                return t
-        raise Exception("Can't parse timestamp from: " + str(self.message[:100]))
+        if self.message['timestamp'] is None:
+            if self.message['timestamp_error'] is not None:
+                raise self.message['timestamp_error']
+            raise Exception("Can't parse timestamp from: " + str(self.message['message'][:100]))
+        return self.message['timestamp']
 
     def get_message_type(self):
-        content = self.get_content()
-        if content:
-            if "Voice call" in content or "voice call" in content:
-                return MessageType.CALL_AUDIO
-            elif "Video call" in content or "video call" in content:
-                return MessageType.CALL_VIDEO
-            elif ".opus>" in content or 'audio omitted' == content or 'аудиофайл отсутствует' in content:
-                return MessageType.MESSAGE_VOICE
-            else:
-                return MessageType.MESSAGE
-        return MessageType.CALL_UNDEFINED
-
-    def get_symbols_count(self):
-        not_text = self.get_picture_count() > 0 or self.get_video_count() > 0 or self.get_message_type() != MessageType.MESSAGE
-        return 0 if not_text else self.message_structure['symbols_count']
+        return self.message['message_type']
 
     def get_picture_count(self):
-        content = self.get_content()
-        return return_num(content == 'image omitted' or content == 'GIF omitted') \
-            + return_num(".jpg" in content) \
-            + return_num("изображение отсутствует" in content)
-
-    def get_emoji_count(self):
-        return self.message_structure['emoji_count']
-
-    def get_link_count(self):
-        return self.message_structure['links_count']
+        return self.message['picture_count']
 
     def get_seconds_count(self):
-        content = self.get_content()
-        match = re.search(r'(\d+) min', content)
-        if match:
-            return int(match.group(1)) * 60
-        match = re.search(r'(\d+) sec', content)
-        if match:
-            return int(match.group(1))
-        return 0
+        return self.message['seconds_count']
 
     def get_video_count(self):
-        content = self.get_content()
-        return int(bool(re.search(r'<attached:.*\.(mp4|mov)>', content, re.IGNORECASE))) \
-            + return_num('video omitted' in content) \
-            + return_num('видео отсутствует' in content)
-
-    def count_aggregates(self):
-        def count_links(text):
-            url_pattern = r'(https?://(?:www\.)?[^\s]+)'
-            links = re.findall(url_pattern, text)
-            return len(links) + int('.docx' in text) + int('.pptx' in text) + int('.pdf' in text)
-
-        def count_symbols(text):
-            not_text = self.get_picture_count() > 0 or self.get_video_count() > 0 or self.get_message_type() != MessageType.MESSAGE
-            return 0 if not_text else len(text)
-
-        def count_emoji(text):
-            emoji_list = [char for char in text if char in emoji.EMOJI_DATA]
-            return len(emoji_list)
-
-        message_text = self.get_content()
-        return {
-            "symbols_count": count_symbols(message_text),
-            "links_count": count_links(message_text),
-            "emoji_count": count_emoji(message_text)
-        }
+        return self.message['video_count']
+
+    def get_message_text(self):
+        return self.get_content()
+
+    def collect_text(self):
+        super().collect_text()
+        self.data['is_text'].append(self.message['is_text'])
+
+    def count_text_features(self):
+        texts = self.data.pop('text', None)
+        is_text = self.data.pop('is_text', None)
+        if not texts:
+            return
+        symbols_counts = [symbols_count if text_flag else 0
+                          for symbols_count, text_flag in zip(text_metrics.count_symbols_column(texts), is_text)]
+        # attached documents count as links
+        link_counts = [links_count + ('.docx' in text) + ('.pptx' in text) + ('.pdf' in text)
+                       for links_count, text in zip(text_metrics.count_links_column(texts), texts)]
+        self.add_text_features(symbols_counts, link_counts, text_metrics.count_emoji_column(texts))
 
     def update_aggregated_chat_info(self):
         self.count_target_user_messages += 1
-        self.message_structure = self.count_aggregates()
-        if self.get_timestamp() == self.prev_date_unixtime and self.get_message_type() == self.data['message_type'][-1]:
-            self.need_append_message = False
-            self.data['picture_count'][-1] += self.get_picture_count()
-            self.data['video_count'][-1] += self.get_video_count()
-            self.data['seconds_count'][-1] += self.get_seconds_count()
-        else:
-            self.need_append_message = True
-            self.prev_date_unixtime = self.get_timestamp()
 
     def get_target_used_id(self):
         return self.user_id_mapper
 
     def get_active_user_id(self):
-        return get_hash(self.get_active_user_nickname())
+        return self.nickname_ids.get_id(self.get_active_user_nickname())
 
     def get_content(self):
-
-        timestamp_patterns = [
-            r'^\[\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2}:\d{2}\]',  # [dd.mm.yyyy, hh:mm:ss]
-            r'^\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2} -',  # dd.mm.yyyy, hh:mm -
-            r'^\d{1,2}/\d{1,2}/\d{2}, \d{2}:\d{2} -',  # m/d/yy, hh:mm -
-            r'^\[\d{2}\.\d{2}\.\d{2}, \d{2}:\d{2}:\d{2}\]', # [dd.mm.yy, hh:mm:ss]
-            r'^\[\d{2}-\d{2}-\d{4}, \d{2}:\d{2}:\d{2}\]'  # [dd-mm-yyyy, hh:mm:ss]
-        ]
-
-        for i, pattern in enumerate(timestamp_patterns):
-            if re.match(pattern, self.message):
-                colon_index = 3 if i == 0 else 2
-                parts = self.message.split(': ', colon_index)
-                res = ': '.join(parts[1:]).replace('\r\n', '').replace('\n', '')
-                return res
-
-        raise Exception("Failed to get content for message with start: " + self.message[:50])
+        if self.message['content'] is None:
+            raise Exception("Failed to get content for message with start: " + self.message['message'][:50])
+        return self.message['content']
 
     def get_active_user_nickname(self):
-        match = re.search(r'[\]\-] (.*?):', self.message)
-        if match:
-            return match.group(1)
-        else:
-            return DEFAULT_VALUE
+        return self.message['nickname']
 
     def start(self):
         return
@@ -177,17 +244,18 @@ class WhatsappMessageProcessor(MessageProcessor):
 
 
 class WhatsappProcessor(Processor):
-    def __init__(self, data, custom_target_user_id, update_progress):
-        super().__init__(Platform.WHATSAPP, custom_target_user_id, update_progress)
+    def __init__(self, data, custom_target_user_id, update_progress, workers=1, time_window=None):
+        super().__init__(Platform.WHATSAPP, custom_target_user_id, update_progress, workers, time_window)
         self.data = data
 
     def get_chat_paths(self):
         link_list = []
-        for filename in os.listdir(self.data):
+        for filename in list_dir(self.data):
             path = os.path.join(self.data, filename)
             link_list.append({
                 'path': path,
-                'id': get_hash(path),
+                # the file name stays the same between exports, unlike the folder
+                'id': self.identities.get_table(CHAT_IDS).get_id(filename),
                 'name': filename,
                 'messages': []
             })
@@ -197,56 +265,195 @@ class WhatsappProcessor(Processor):
         self.user_id_mapper = self.custom_target_user_id
         self.process_chats(self.get_chat_paths())
 
-    def sanitize_input(self, text):
-        return ''.join(c for c in text if c.isprintable())
-
     def sanitize_input(self, text):
         # This function removes non-printable characters including Unicode marks
         return ''.join(c for c in text if c.isprintable())
 
-    def get_messages(self, raw_data):
-        # Updated patterns to allow one or two digits for day and month
-        timestamp_patterns = [
-            r'^\[\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2}:\d{2}\]',  # [dd.mm.yyyy, hh:mm:ss]
-            r'^\d{2}\.\d{2}\.\d{4}, \d{2}:\d{2} -',          # dd.mm.yyyy, hh:mm -
-            r'^\d{1,2}/\d{1,2}/\d{2}, \d{2}:\d{2} -',         # m/d/yy, hh:mm - (allows single-digit month and day)
-            r'^\[\d{2}\.\d{2}\.\d{2}, \d{2}:\d{2}:\d{2}\]',  # [dd.mm.yy, hh:mm:ss]
-            r'^\[\d{2}-\d{2}-\d{4}, \d{2}:\d{2}:\d{2}\]'  # [dd-mm-yyyy, hh:mm:ss]
-        ]
-        combined_pattern = '|'.join(timestamp_patterns)
-        lines = raw_data.split('\n')
-        messages = []
+    def decode_line(self, raw_line):
+        line = raw_line.decode('utf-8').rstrip('\n')
+        if '\r' in line:
+            # text mode used to turn a lone \r into a line break too
+            return line.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return [line]
+
+    def read_lines(self, file_path, dialect=None, offset=None):
+        # the file is mapped once, archive members are decompressed once per chat. Without an offset
+        # the lines start at the time window
+        with map_file(file_path) as data:
+            if data is None:
+                return
+            if offset is None:
+                offset = self.find_window_offset(data, dialect)
+            data.seek(offset)
+            stats = get_active()
+            try:
+                for raw_line in iter(data.readline, b''):
+                    yield from self.decode_line(raw_line)
+            finally:
+                stats.count('bytes_read', data.tell() - offset)
+
+    def find_header(self, data, position, dialect):
+        # (offset, timestamp) of the first message header line starting at or after position
+        if position > 0:
+            position = data.find(b'\n', position - 1) + 1
+            if position == 0:
+                return None
+        data.seek(position)
+        for _ in range(SEEK_LINES):
+            offset = data.tell()
+            raw_line = data.readline()
+            if not raw_line:
+                return None
+            start = match_message_start(self.clean_line(raw_line.decode('utf-8', errors='replace')), dialect)
+            if start is not None and start[0] == dialect:
+                try:
+                    return offset, int(datetime.strptime(start[1].strip('[]'), DIALECTS[dialect][1]).timestamp())
+                except (ValueError, OverflowError, OSError):
+                    continue
+        return None
+
+    def find_window_offset(self, data, dialect):
+        # binary search for the last header that is surely older than the time window
+        border = self.time_window[0]
+        if dialect is None or border is None:
+            return 0
+        border -= SEEK_MARGIN
+        offset = 0
+        low, high = 0, len(data)
+        while low < high:
+            middle = (low + high) // 2
+            header = self.find_header(data, middle, dialect)
+            if header is None or header[1] >= border:
+                high = middle
+            else:
+                offset = header[0]
+                low = middle + 1
+        return offset
+
+    def detect_file_dialect(self, file_path):
+        # only the first lines are read, an archive member isn't decompressed whole for them
+        lines = []
+        with open_file(file_path) as f:
+            for raw_line in iter(f.readline, b''):
+                get_active().count('bytes_read', len(raw_line))
+                lines.extend(self.clean_line(line) for line in self.decode_line(raw_line))
+                if len(lines) >= DIALECT_SNIFF_LINES:
+                    break
+        return detect_dialect(lines[:DIALECT_SNIFF_LINES])
+
+    def get_messages(self, file_path, dialect, offset=None):
+        lines = self.read_lines(file_path, dialect, offset)
+        stats = get_active()
+        batch = []
         current_message = []
-        for line in lines:
-            sanitized_line = self.sanitize_input(line).strip()
-            if re.match(combined_pattern, sanitized_line):
+        current_start = None
+        # lines of a batch are read and split with nothing else in between, the time is taken per batch
+        batch_start_time = perf_counter()
+        for line in (self.clean_line(line) for line in lines):
+            start = match_message_start(line, dialect)
+            if start is not None:
                 if current_message:
-                    messages.append('\n'.join(current_message).strip())
+                    batch.append(create_record('\n'.join(current_message).strip(), current_start))
                     current_message = []
-            current_message.append(sanitized_line)
+                    if len(batch) >= MESSAGES_BATCH_SIZE:
+                        stats.add_time('read', perf_counter() - batch_start_time)
+                        yield from self.parse_records(batch, dialect)
+                        batch = []
+                        batch_start_time = perf_counter()
+                current_start = start
+            current_message.append(line)
         if current_message:
-            messages.append('\n'.join(current_message).strip())
-        return messages
-
-    def read_file(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+            batch.append(create_record('\n'.join(current_message).strip(), current_start))
+        stats.add_time('read', perf_counter() - batch_start_time)
+        yield from self.parse_records(batch, dialect)
+
+    def parse_records(self, records, dialect):
+        stats = get_active()
+        with stats.timer('timestamps'):
+            parse_timestamps(records, dialect)
+        # messages outside the time window would be skipped by process, they aren't parsed at all
+        with stats.timer('parse'):
+            return [parse_message(record) for record in records
+                    if record['timestamp'] is None or in_time_window(record['timestamp'], self.time_window)]
+
+    def clean_line(self, line):
+        if not line.isprintable():
+            line = self.sanitize_input(line)
+        return line.strip()
 
     def start_process_chat(self, chat):
-        raw_data = self.read_file(chat['path'])
-        chat['messages'] = self.get_messages(raw_data)
+        chat['dialect'] = self.detect_file_dialect(chat['path'])
+        chat['messages'] = self.get_messages(chat['path'], chat['dialect'])
         self.chat_info = {
             'chat_id': int(chat['id']),
         }
-        return WhatsappMessageProcessor(self.user_id_mapper)
+        return WhatsappMessageProcessor(self.user_id_mapper, self.identities.get_table(NICKNAME_IDS), self.time_window)
+
+    def screen_chat(self, chat):
+        # the header lines carry nothing cheaper than the records, so the first records are screened
+        # and then handed on to the processing. Every processed message counts as the target user's here,
+        # so only the three authors rule can skip a chat
+        messages = iter(chat['messages'])
+        screened = []
+        chat['messages'] = chain(screened, messages)
+        processor = self.message_processor
+        screen = ChatScreen(processor.get_target_used_id(), messages_count_to_continue=None)
+        for message in islice(messages, SCREEN_MESSAGES):
+            screened.append(message)
+            if message['content'] is None or message['timestamp'] is None:
+                return False
+            if message['content'] == "" or not in_time_window(message['timestamp'], self.time_window):
+                continue
+            if screen.add(processor.nickname_ids.get_id(message['nickname']), message['timestamp'], message['message_type']):
+                processor.skip_reason = screen.skip_reason
+                return True
+        return False
+
+    def get_chat_key(self, chat):
+        # the file name stays the same across exports while the folder doesn't
+        return chat['name']
+
+    def get_chat_fingerprint(self, chat):
+        return {
+            'size': get_size(chat['path']),
+            'hash': get_file_hash(chat['path']),
+        }
+
+    def can_resume_chat(self, chat, previous):
+        # exports of a grown chat append to the old file, which then is a prefix of the new one
+        resume = previous['resume']
+        offset = previous['fingerprint']['size']
+        path = chat['path']
+        if resume is None or resume['dialect'] is None or offset == 0 or get_size(path) <= offset:
+            return False
+        if get_file_hash(path, offset) != previous['fingerprint']['hash']:
+            return False
+        if self.detect_file_dialect(path) != resume['dialect']:
+            return False
+        with open_file(path) as f:
+            f.seek(offset - 1)
+            if f.read(1) != b'\n':
+                return False
+            line = f.readline().decode('utf-8', errors='replace')
+        # the appended part has to start with a new message, otherwise the last one has grown
+        return match_message_start(self.clean_line(line), resume['dialect']) is not None
+
+    def resume_chat(self, chat, previous):
+        resume = previous['resume']
+        self.message_processor.set_state(resume['state'], read_columns(previous['columns_path']) or {})
+        chat['messages'] = self.get_messages(chat['path'], resume['dialect'], previous['fingerprint']['size'])
+
+    def get_resume_info(self, chat, entry):
+        return {
+            'dialect': chat['dialect'],
+            'state': self.message_processor.get_state(),
+        }
 
     def finish_process_chat(self):
         messages = self.message_processor.data
         if len(messages) == 0:
-            return pd.DataFrame()
+            return self.chat_info, messages
         self.chat_info['chat_users_count'] = len(set(messages['active_user_id']))
         self.chat_info['partner_used_id'] = DEFAULT_VALUE_NUM
         self.chat_info['partner_user_nickname'] = DEFAULT_VALUE
-        data = {key: [value] * len(next(iter(messages.values()))) for key, value in self.chat_info.items()}
-        data.update(messages)
-        return pd.DataFrame(data)
+        return self.chat_info, messages
@@ -0,0 +1,36 @@
+import importlib
+
+from archives import resolve_export
+from utils import Platform
+
+# module and class of the processor of every platform. A module is imported once its platform is
+# selected, so the window comes up before pandas, the html parsers and the emoji tables are loaded
+PROCESSORS = {
+    Platform.TELEGRAM: ('messangers.tg', 'TelegramProcessor'),
+    Platform.WHATSAPP: ('messangers.whatsapp', 'WhatsappProcessor'),
+    Platform.VK: ('messangers.vk', 'VkProcessor'),
+}
+
+# exports are read from their folder or straight from a zip archive of it
+READERS = {
+    Platform.TELEGRAM: lambda x: resolve_export(x, 'result.json'),
+    Platform.WHATSAPP: resolve_export,
+    Platform.VK: resolve_export,
+}
+
+
+def get_processor_class(platform):
+    if platform not in PROCESSORS:
+        raise Exception(f"Unknown platform: {platform}\n")
+    module_name, class_name = PROCESSORS[platform]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_processor(platform, data, user_id, update_progress, workers=1, time_window=None):
+    return get_processor_class(platform)(data, int(user_id), update_progress, workers, time_window)
+
+
+def get_reader(platform):
+    if platform not in READERS:
+        raise Exception(f"Unknown platform: {platform}\n")
+    return READERS[platform]
@@ -1,50 +1,268 @@
-import pandas as pd
+import cProfile
+import os
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import pandas as pd
+
+from archives import close_archives
+from data_extractor import get_default_time_window
+from identities import Identities
+from instrumentation import Stats, set_active
+from manifest import window_allows_reuse
+from result_builder import DEFAULT_MEMORY_BUDGET, ResultBuilder
+
+# chats handed to the pool ahead of the one being collected, per worker
+CHATS_IN_FLIGHT_PER_WORKER = 2
+
+worker_processor = None
+
+
+def init_chat_worker(processor):
+    global worker_processor
+    worker_processor = processor
+
+
+def process_chat_in_worker(chat):
+    return worker_processor.process_chat(chat)
+
 
 class Processor(ABC):
-    def __init__(self, name, custom_target_user_id, update_progress):
+    # state that stays in the parent process when the processor is sent to pool workers
+    worker_excluded_fields = ('update_progress', 'processed', 'result_builder', 'message_processor', 'manifest', 'stats')
+
+    def __init__(self, name, custom_target_user_id, update_progress, workers=1, time_window=None):
         self.custom_target_user_id = custom_target_user_id
         self.context = {
             'name': name
         }
         self.update_progress = update_progress
+        self.workers = workers or os.cpu_count() or 1
+        # fixed once per run so every chat and worker uses the same border
+        self.time_window = time_window or get_default_time_window()
         self.processed = pd.DataFrame()
+        self.result_builder = ResultBuilder()
         self.skipped_chats = 0
         self.all_chats = 0
         self.skipped_chat_ids = []
+        self.manifest = None
+        self.incremental = False
+        # stage timings and counters of the run, chats processed by pool workers add their cpu time up
+        self.stats = Stats()
+        self.profile_path = None
+        self.cancelled = False
+        # ids of nicknames and chat names, workers get a copy and send back the ids they assign
+        self.identities = Identities()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for field in self.worker_excluded_fields:
+            state.pop(field, None)
+        return state
 
     @abstractmethod
     def run(self):
         pass
 
-    def process_chats(self, chats):
-        chats_len = float(len(chats))
-        self.all_chats = int(chats_len)
-        processed_num = 0
-        for chat in chats:
-            self.message_processor = self.start_process_chat(chat)
-            for message in chat['messages']:
-                if not self.message_processor.continue_processing:
-                    break
-                self.message_processor.time = None
-                self.message_processor.process(message)
-            if self.message_processor.continue_processing:
-                self.processed = pd.concat([self.finish_process_chat(), self.processed], ignore_index=True)
+    def set_manifest(self, manifest):
+        # incremental mode, unchanged chats of the previous run are taken from the manifest
+        self.manifest = manifest
+        self.incremental = manifest is not None
+
+    def set_output(self, sink=None, legacy_message_types=False, memory_budget=DEFAULT_MEMORY_BUDGET):
+        # with a sink results are written chat by chat and processed stays empty. Without one results past
+        # memory_budget are spilled to temporary files, processed stays empty then too and sinks.write_result
+        # exports them
+        self.result_builder = ResultBuilder(sink, legacy_message_types, memory_budget)
+
+    def cancel(self):
+        # may be called from another thread, the run stops once the chat in progress is done
+        self.cancelled = True
+
+    def set_identities(self, identities):
+        self.identities = identities
+
+    def set_profile(self, path):
+        # cProfile of the run is dumped there, chats processed by pool workers aren't in it
+        self.profile_path = path
+
+    def attach_previous(self, chat):
+        chat['previous'] = self.manifest.get_previous(self.get_chat_key(chat))
+        return chat
+
+    def process_chats(self, chats, get_progress=None):
+        # readers running in the parent between chats report to the stats of the run
+        previous_stats = set_active(self.stats)
+        try:
+            if self.profile_path:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(self.collect_chats, chats, get_progress)
+                finally:
+                    profiler.dump_stats(self.profile_path)
             else:
+                self.collect_chats(chats, get_progress)
+        finally:
+            set_active(previous_stats)
+            close_archives()
+
+    def collect_chats(self, chats, get_progress=None):
+        if get_progress is None:
+            chats_len = float(len(chats))
+            get_progress = lambda processed_num: processed_num / chats_len
+        if self.incremental:
+            chats = (self.attach_previous(chat) for chat in chats)
+        if self.workers > 1:
+            results = self.process_chats_parallel(chats)
+        else:
+            results = (self.process_chat(chat) for chat in chats)
+        processed_num = 0
+        for chat_info, columns, entry, chat_stats, identities in results:
+            self.stats.merge(chat_stats)
+            self.identities.merge(identities)
+            if entry is not None:
+                self.stats.count('chats_reused', int(entry.get('reused', False)))
+                self.stats.count('chats_resumed', int(entry.get('resumed', False)))
+                chat_info, columns = self.manifest.update(chat_info, columns, entry)
+            if columns is None:
                 self.skipped_chats += 1
-                self.skipped_chat_ids.append(self.chat_info['chat_id'])
+                self.skipped_chat_ids.append(chat_info['chat_id'])
+            else:
+                with self.stats.timer('output'):
+                    self.result_builder.add_chunk(chat_info, columns)
             processed_num += 1
-            self.update_progress(100 * processed_num / chats_len)
-            chat.clear()
+            self.all_chats = processed_num
+            self.update_progress(100 * get_progress(processed_num))
+            if self.cancelled:
+                # the chats processed so far stay in the result
+                break
+        self.stats.count('chats_processed', processed_num)
+        self.stats.count('chats_skipped', self.skipped_chats)
+        self.stats.count('identity_collisions', self.identities.get_collisions())
+        with self.stats.timer('build'):
+            self.processed = self.result_builder.build()
+
+    def process_chats_parallel(self, chats):
+        with ProcessPoolExecutor(self.workers, initializer=init_chat_worker, initargs=(self,)) as executor:
+            pending = deque()
+            try:
+                for chat in chats:
+                    pending.append(executor.submit(process_chat_in_worker, chat))
+                    if len(pending) >= self.workers * CHATS_IN_FLIGHT_PER_WORKER:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # a cancelled run doesn't wait for the chats that haven't started yet
+                for future in pending:
+                    future.cancel()
+
+    def process_chat(self, chat):
+        # every chat reports to stats of its own, the readers find them with get_active
+        stats = Stats()
+        previous_stats = set_active(stats)
+        try:
+            with stats.timer('other'):
+                result = self.process_chat_stages(chat, stats)
+        finally:
+            set_active(previous_stats)
+        return result + (stats, self.identities.drain())
+
+    def process_chat_stages(self, chat, stats):
+        start_time = perf_counter()
+        previous = chat.pop('previous', None)
+        entry = None
+        resume = False
+        if self.incremental:
+            entry = {
+                'key': self.get_chat_key(chat),
+                'fingerprint': self.get_chat_fingerprint(chat),
+                'time_window': list(self.time_window),
+            }
+            if previous is not None and window_allows_reuse(previous, self.time_window):
+                if entry['fingerprint'] is not None and previous['fingerprint'] == entry['fingerprint']:
+                    entry['reused'] = True
+                    # the chat id of this run is kept. Whatsapp chats are keyed by file name and their ids come from
+                    # the identities table, a collision settled without the saved table of the previous run moves one
+                    entry['chat_id'] = int(chat['id'])
+                    chat.clear()
+                    return None, None, entry
+                resume = self.can_resume_chat(chat, previous)
+
+        with stats.timer('start'):
+            self.message_processor = self.start_process_chat(chat)
+        processor = self.message_processor
+        screened = False
+        if resume:
+            with stats.timer('resume'):
+                self.resume_chat(chat, previous)
+        else:
+            with stats.timer('screen'):
+                screened = self.screen_chat(chat)
+        if screened:
+            processor.continue_processing = False
+            stats.count('chats_screened')
+        else:
+            with stats.timer('messages'):
+                for message in chat['messages']:
+                    if not processor.continue_processing:
+                        break
+                    processor.process(message)
+                stats.add_time('collect', processor.collect_seconds)
+        if processor.continue_processing:
+            with stats.timer('coalesce'):
+                processor.coalesce_messages()
+            with stats.timer('text_features'):
+                processor.count_text_features()
+            with stats.timer('finish'):
+                chat_info, columns = self.finish_process_chat()
+            result = chat_info, dict(columns)
+        else:
+            result = self.chat_info, None
+        stats.count('messages_seen', processor.messages_seen)
+        stats.count('messages_filtered', processor.messages_filtered)
+        stats.count('messages_merged', processor.messages_merged)
+        stats.count('messages_kept', processor.messages_seen - processor.messages_filtered - processor.messages_merged)
+        skip_reason = None if processor.continue_processing else processor.skip_reason
+        stats.add_chat(result[0]['chat_id'], perf_counter() - start_time, processor.messages_seen, skip_reason)
+        if entry is not None:
+            timestamps = self.message_processor.data['timestamp']
+            entry.update({
+                'first_timestamp': min(timestamps) if timestamps else None,
+                'resume': self.get_resume_info(chat, entry),
+                'resumed': resume,
+            })
+        chat.clear()
+        return result + (entry,)
 
     @abstractmethod
     def start_process_chat(self, chat):
         pass
 
-    @abstractmethod
-    def finish_process_chat(self):
+    def get_chat_key(self, chat):
+        # identifies a chat across exports of the same account
+        return str(chat['id'])
+
+    def get_chat_fingerprint(self, chat):
+        # changes whenever the content of the chat does, None never matches a previous run
+        return None
+
+    def can_resume_chat(self, chat, previous):
+        # True when the chat only grew since the previous run and can continue from where it stopped
+        return False
+
+    def resume_chat(self, chat, previous):
         pass
 
+    def get_resume_info(self, chat, entry):
+        return None
 
+    def screen_chat(self, chat):
+        # True when the chat is certain to be skipped, checked before its messages are processed
+        return False
 
+    @abstractmethod
+    def finish_process_chat(self):
+        pass
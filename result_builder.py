@@ -0,0 +1,126 @@
+import os
+import tempfile
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from utils import MessageType
+
+# dtypes of the result columns, nicknames repeat on every row of a chat so they are categories.
+# Timestamps stay int64, int32 runs out in 2038
+COLUMN_TYPES = {
+    'chat_id': 'int64',
+    'chat_users_count': 'int32',
+    'partner_used_id': 'int64',
+    'partner_user_nickname': 'category',
+    'active_user_nickname': 'category',
+    'active_user_id': 'int64',
+    'timestamp': 'int64',
+    'message_type': 'int8',
+    'symbols_count': 'int32',
+    'picture_count': 'int16',
+    'emoji_count': 'int32',
+    'link_count': 'int32',
+    'video_count': 'int16',
+    'seconds_count': 'int32',
+    'is_forwarded': 'bool',
+}
+# results kept in memory before they are spilled to disk, counted with a rough size of a collected value
+DEFAULT_MEMORY_BUDGET = 512 << 20
+VALUE_MEMORY = 20
+MESSAGE_TYPE_CODES = {value: int(value) for name, value in vars(MessageType).items() if not name.startswith('_')}
+
+
+def build_frame(chunks, legacy_message_types=False):
+    lengths = [rows_count for rows_count, _, _ in chunks]
+    rows_count = sum(lengths)
+    data = {}
+    for key in chunks[0][1]:
+        values = pd.Series([chat_info[key] for _, chat_info, _ in chunks], dtype=COLUMN_TYPES.get(key))
+        data[key] = values.repeat(lengths).reset_index(drop=True)
+    for key in chunks[0][2]:
+        values = chain.from_iterable(columns[key] for _, _, columns in chunks)
+        column_type = COLUMN_TYPES.get(key)
+        if key == 'message_type' and legacy_message_types:
+            # the string codes of MessageType, as the table had them before
+            data[key] = list(values)
+        elif key == 'message_type':
+            data[key] = np.fromiter((MESSAGE_TYPE_CODES[value] for value in values), column_type, rows_count)
+        elif column_type == 'category':
+            data[key] = pd.Categorical(list(values))
+        elif column_type is not None:
+            data[key] = np.fromiter(values, column_type, rows_count)
+        else:
+            data[key] = list(values)
+    return pd.DataFrame(data)
+
+
+class ResultBuilder:
+    def __init__(self, sink=None, legacy_message_types=False, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.chunks = []
+        # with a sink every chat is written as it finishes and nothing is kept
+        self.sink = sink
+        self.legacy_message_types = legacy_message_types
+        self.rows = 0
+        # past the budget the chats kept so far are written to a temporary file as one frame, None keeps all of them
+        self.memory_budget = memory_budget
+        self.buffered_memory = 0
+        self.spill_folder = None
+        self.spill_paths = []
+        self.frame = None
+
+    def add_chunk(self, chat_info, columns):
+        rows_count = len(next(iter(columns.values()), []))
+        if rows_count == 0:
+            return
+        chunk = (rows_count, dict(chat_info), columns)
+        self.rows += rows_count
+        if self.sink is not None:
+            self.sink.write(build_frame([chunk], self.legacy_message_types))
+            return
+        self.chunks.append(chunk)
+        self.buffered_memory += rows_count * (len(chat_info) + len(columns)) * VALUE_MEMORY
+        if self.memory_budget is not None and self.buffered_memory > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        if not self.chunks:
+            return
+        if self.spill_folder is None:
+            self.spill_folder = tempfile.TemporaryDirectory(prefix='processed-')
+        path = os.path.join(self.spill_folder.name, f'{len(self.spill_paths)}.pkl')
+        build_frame(self.chunks[::-1], self.legacy_message_types).to_pickle(path)
+        self.spill_paths.append(path)
+        self.chunks = []
+        self.buffered_memory = 0
+
+    def rows_count(self):
+        return self.rows
+
+    def build(self):
+        if self.spill_paths:
+            # the result doesn't fit the budget as one frame, it stays on disk and is read back by iter_frames
+            self.spill()
+            return pd.DataFrame()
+        if not self.chunks:
+            return pd.DataFrame()
+        # newest chat goes first, the same order the per-chat concat produced
+        self.frame = build_frame(self.chunks[::-1], self.legacy_message_types)
+        self.chunks = []
+        return self.frame
+
+    def iter_frames(self):
+        # the result in the order of build, one spilled file at a time
+        if self.frame is not None:
+            yield self.frame
+        elif self.chunks:
+            yield build_frame(self.chunks[::-1], self.legacy_message_types)
+        for path in reversed(self.spill_paths):
+            yield pd.read_pickle(path)
+
+    def close(self):
+        if self.spill_folder is not None:
+            self.spill_folder.cleanup()
+            self.spill_folder = None
+        self.spill_paths = []
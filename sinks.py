@@ -0,0 +1,155 @@
+import bz2
+import gzip
+import lzma
+import os
+
+from result_builder import COLUMN_TYPES
+
+# rows collected before a parquet row group or an arrow record batch is written
+ROW_GROUP_SIZE = 1 << 16
+
+COMPRESSIONS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'json',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+def split_compression(path):
+    root, extension = os.path.splitext(path.lower())
+    if extension in COMPRESSIONS:
+        return root, extension
+    return path.lower(), None
+
+
+def get_output_format(output_path, output_format=None):
+    if output_format:
+        return output_format
+    root, _ = split_compression(output_path)
+    return FORMAT_EXTENSIONS.get(os.path.splitext(root)[1], 'csv')
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("parquet and arrow output need pyarrow, install it with: pip install pyarrow")
+    return pyarrow
+
+
+class TextSink:
+    # csv or json lines, compressed when the path ends with .gz, .bz2 or .xz
+    def __init__(self, path, output_format):
+        self.output_format = output_format
+        open_file = COMPRESSIONS.get(split_compression(path)[1], open)
+        self.file = open_file(path, 'wt', encoding='utf-8', newline='')
+        self.header = True
+
+    def write(self, frame):
+        if self.output_format == 'csv':
+            frame.to_csv(self.file, index=False, header=self.header)
+        else:
+            text = frame.to_json(orient='records', lines=True, force_ascii=False)
+            self.file.write(text if text.endswith('\n') else text + '\n')
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowSink:
+    # parquet row groups or arrow ipc record batches, with the column types of the result builder
+    def __init__(self, path, output_format):
+        self.pa = import_pyarrow()
+        self.path = path
+        self.output_format = output_format
+        self.writer = None
+        self.schema = None
+        self.tables = []
+        self.buffered_rows = 0
+
+    def get_type(self, type_name):
+        if type_name == 'category':
+            return self.pa.dictionary(self.pa.int32(), self.pa.string())
+        if type_name == 'bool':
+            return self.pa.bool_()
+        return getattr(self.pa, type_name)()
+
+    def get_schema(self, table):
+        # the dtypes of the result builder, category index widths and values vary from chat to chat
+        fields = []
+        for field in table.schema:
+            if self.pa.types.is_dictionary(field.type):
+                field = field.with_type(self.get_type('category'))
+            fields.append(field)
+        return self.pa.schema(fields)
+
+    def open_writer(self, schema):
+        self.schema = schema
+        if self.output_format == 'parquet':
+            self.writer = self.pa.parquet.ParquetWriter(self.path, schema)
+        else:
+            self.writer = self.pa.ipc.new_file(self.path, schema)
+
+    def write(self, frame):
+        table = self.pa.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.open_writer(self.get_schema(table))
+        self.tables.append(table.cast(self.schema))
+        self.buffered_rows += len(frame)
+        if self.buffered_rows >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.tables:
+            return
+        table = self.pa.concat_tables(self.tables).combine_chunks()
+        if self.output_format == 'parquet':
+            self.writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        else:
+            self.writer.write_table(table, max_chunksize=ROW_GROUP_SIZE)
+        self.tables = []
+        self.buffered_rows = 0
+
+    def close(self):
+        if self.writer is None:
+            # nothing was written, the file still gets the usual columns
+            self.open_writer(self.pa.schema([(name, self.get_type(type_name)) for name, type_name in COLUMN_TYPES.items()]))
+        self.flush()
+        self.writer.close()
+
+
+SINKS = {
+    'csv': TextSink,
+    'json': TextSink,
+    'parquet': ArrowSink,
+    'arrow': ArrowSink,
+}
+
+
+def open_sink(path, output_format=None):
+    output_format = get_output_format(path, output_format)
+    if output_format not in SINKS:
+        raise Exception(f"Unknown output format: {output_format}")
+    return SINKS[output_format](path, output_format)
+
+
+def write_result(result_builder, path, output_format=None):
+    # the frames of the result builder one by one, the spilled ones are never in memory together
+    sink = open_sink(path, output_format)
+    try:
+        for frame in result_builder.iter_frames():
+            sink.write(frame)
+    finally:
+        sink.close()
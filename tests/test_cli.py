@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cli import get_time_window, main
+
+
+def get_timestamp(value):
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def write_export(path, dates):
+    messages = []
+    for index, date in enumerate(dates):
+        from_id, name = ('user1', 'Ivan') if index % 2 == 0 else ('user100', 'Partner')
+        messages.append({'id': index, 'type': 'message', 'date_unixtime': str(get_timestamp(date)),
+                         'from': name, 'from_id': from_id, 'text': f'message {index}'})
+    export = {
+        'personal_information': {'user_id': 1, 'first_name': 'Ivan', 'last_name': ''},
+        'chats': {'list': [{'name': 'Partner', 'type': 'personal_chat', 'id': 100, 'messages': messages}]},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(export, f)
+
+
+def test_until_date_includes_the_whole_day():
+    start, end = get_time_window('2023-01-05', '2023-01-05')
+    assert start == get_timestamp('2023-01-05')
+    assert end == get_timestamp('2023-01-06') - 1
+    assert get_time_window('2023-01-05', '2023-01-05T12:30')[1] == get_timestamp('2023-01-05T12:30')
+
+
+def test_one_day_window(tmp_path):
+    day = ['2023-01-05T09:00', '2023-01-05T09:05', '2023-01-05T12:00', '2023-01-05T12:10', '2023-01-05T23:59']
+    input_path = str(tmp_path / 'result.json')
+    write_export(input_path, ['2023-01-04T23:00', '2023-01-04T23:30'] + day + ['2023-01-06T00:00'])
+    output_path = str(tmp_path / 'out.json')
+    report_path = str(tmp_path / 'report.json')
+    assert main(['--platform', 'telegram', '--input', input_path, '--user-id', '1', '--output', output_path,
+                 '--workers', '1', '--since', '2023-01-05', '--until', '2023-01-05', '--report', report_path]) == 0
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)['reports'][0]
+    assert report['rows'] == len(day)
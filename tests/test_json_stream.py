@@ -0,0 +1,36 @@
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_stream import JsonStream
+
+DOCUMENT = '{"rating": 0.75, "values": [-2.5, 1, 1e5, -3E-2, 12345, 0, true, null, "a"], "last": -0.125}'
+
+
+def read_document(stream):
+    result = {}
+    for key in stream.iter_object():
+        if key == 'values':
+            result[key] = []
+            for _ in stream.iter_array():
+                result[key].append(stream.read_value())
+        else:
+            result[key] = stream.read_value()
+    return result
+
+
+def test_numbers_cut_at_every_position():
+    data = DOCUMENT.encode()
+    expected = json.loads(DOCUMENT)
+    for chunk_size in range(1, len(data) + 1):
+        assert read_document(JsonStream(io.BytesIO(data), chunk_size=chunk_size)) == expected, chunk_size
+
+
+def test_number_cut_after_point():
+    data = b'[-2.5, 1]'
+    stream = JsonStream(io.BytesIO(data), chunk_size=2)
+    values = [stream.read_value() for _ in stream.iter_array()]
+    assert values == [-2.5, 1]
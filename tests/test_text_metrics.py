@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_metrics import count_emoji, count_emoji_column
+
+EMOJI_COUNTS = {
+    'hello': 0,
+    'привет мир': 0,
+    '': 0,
+    'a😀b😀': 2,
+    '❤️': 1,
+    '👨‍👩‍👧': 1,
+    '👩🏽‍💻': 1,
+    '🏳️‍🌈': 1,
+    '🇷🇺': 1,
+    '🇷🇺🇺🇸': 2,
+    '#️⃣': 1,
+    '1⃣': 1,
+    '1️⃣ text': 1,
+    '👍🏽': 1,
+    '👍🏽👍': 2,
+}
+
+
+def test_count_emoji_sequences():
+    for text, count in EMOJI_COUNTS.items():
+        assert count_emoji(text) == count, text
+
+
+def test_column_counts_every_text():
+    texts = list(EMOJI_COUNTS)
+    assert count_emoji_column(texts) == list(EMOJI_COUNTS.values())
+    # without modifiers, joiners and keycaps the emoji are counted without the sequence pattern
+    assert count_emoji_column(['a😀b😀', 'hello', '❤️']) == [2, 0, 1]
+    assert count_emoji_column(['hello', 'world']) == [0, 0]
+
+
+def test_column_sequences_stop_at_text_borders():
+    for texts in (['🇷', '🇺'], ['👍', '🏽'], ['👨‍', '👩'], ['1', '⃣']):
+        assert count_emoji_column(texts) == [count_emoji(text) for text in texts], texts
+
+
+def test_column_with_nul_in_a_text():
+    texts = ['text\x00😀', '👍🏽', '🇷🇺\x00🇷']
+    assert count_emoji_column(texts) == [1, 1, 1]
@@ -0,0 +1,115 @@
+import re
+
+import numpy as np
+
+from emoji_table import EMOJI_RANGES
+
+URL_PATTERN = re.compile(r'(https?://(?:www\.)?[^\s]+)')
+
+# emoji codepoints are folded into a few private-use class markers with one str.translate call
+EMOJI = '\ue000'
+MODIFIER = '\ue001'
+JOINER = '\ue002'
+REGIONAL_INDICATOR = '\ue003'
+KEYCAP = '\ue004'
+MARKERS = (EMOJI, MODIFIER, JOINER, REGIONAL_INDICATOR, KEYCAP)
+
+# no emoji codepoint is below the copyright sign, the sequence characters are handled separately
+EMOJI_CANDIDATE_PATTERN = re.compile('[\xa9\xae\u200d\u203c-\U0010ffff]')
+EMOJI_SEQUENCE_PATTERN = re.compile(
+    f'[#*0-9]{KEYCAP}'
+    f'|{REGIONAL_INDICATOR}{REGIONAL_INDICATOR}'
+    f'|[{EMOJI}{MODIFIER}]{MODIFIER}*(?:{JOINER}[{EMOJI}{MODIFIER}]{MODIFIER}*)*'
+)
+
+
+def build_emoji_classes(emoji_ranges):
+    classes = {codepoint: EMOJI for start, end in emoji_ranges for codepoint in range(start, end)}
+    classes.update({codepoint: MODIFIER for codepoint in range(0x1f3fb, 0x1f400)})
+    classes.update({codepoint: REGIONAL_INDICATOR for codepoint in range(0x1f1e6, 0x1f200)})
+    # tag characters only spell out subdivision flags and the variation selector only picks emoji style
+    classes.update({codepoint: None for codepoint in range(0xe0020, 0xe0080)})
+    classes[0xfe0f] = None
+    classes[0x200d] = JOINER
+    classes[0x20e3] = KEYCAP
+    classes.update({ord(marker): '\ufffd' for marker in MARKERS})
+    return classes
+
+
+EMOJI_CLASSES = build_emoji_classes(EMOJI_RANGES)
+
+
+def count_emoji(text):
+    if text.isascii() or EMOJI_CANDIDATE_PATTERN.search(text) is None:
+        return 0
+    classes = text.translate(EMOJI_CLASSES)
+    if MODIFIER in classes or JOINER in classes or KEYCAP in classes:
+        return len(EMOJI_SEQUENCE_PATTERN.findall(classes))
+    return classes.count(EMOJI) + classes.count(REGIONAL_INDICATOR + REGIONAL_INDICATOR)
+
+
+def count_links(text):
+    return len(URL_PATTERN.findall(text))
+
+
+def count_symbols(text):
+    return len(text)
+
+
+# the column counts join the texts of a chat and run every pattern once over the whole of it,
+# the matches are then given back to their texts by position. Neither a link nor an emoji sequence
+# crosses a line break or a NUL, so the numbers are the ones of the single text functions
+LINK_SEPARATOR = '\n'
+EMOJI_SEPARATOR = '\x00'
+
+
+def count_by_position(positions, text_ends, texts_count):
+    rows = np.searchsorted(text_ends, np.asarray(positions, dtype=np.int64), side='right')
+    return np.bincount(rows, minlength=texts_count).tolist()
+
+
+def count_symbols_column(texts):
+    return [len(text) for text in texts]
+
+
+def count_links_column(texts):
+    joined = LINK_SEPARATOR.join(texts)
+    if 'http' not in joined:
+        return [0] * len(texts)
+    text_ends = np.cumsum([len(text) + 1 for text in texts])
+    return count_by_position([match.start() for match in URL_PATTERN.finditer(joined)], text_ends, len(texts))
+
+
+DROPPED = 0xffffffff
+
+
+def build_emoji_table(emoji_classes):
+    # the translation table as an array over all codepoints, dropped characters get DROPPED
+    table = np.arange(0x110000, dtype=np.uint32)
+    for codepoint, marker in emoji_classes.items():
+        table[codepoint] = DROPPED if marker is None else ord(marker)
+    return table
+
+
+EMOJI_TABLE = build_emoji_table(EMOJI_CLASSES)
+SEQUENCE_MARKERS = np.array([ord(MODIFIER), ord(JOINER), ord(KEYCAP), ord(REGIONAL_INDICATOR)], dtype=np.uint32)
+
+
+def count_emoji_column(texts):
+    joined = EMOJI_SEPARATOR.join(texts)
+    if joined.isascii() or EMOJI_CANDIDATE_PATTERN.search(joined) is None:
+        return [0] * len(texts)
+    if joined.count(EMOJI_SEPARATOR) != len(texts) - 1:
+        # a text has a NUL of its own, the texts can't be told apart after the translation
+        return [count_emoji(text) for text in texts]
+    # the translation is done on the codepoints with the table, str.translate with a dict is slow on long texts.
+    # It drops characters, the text borders are found by the separators it keeps
+    classes = EMOJI_TABLE[np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32)]
+    classes = classes[classes != DROPPED]
+    text_ends = np.flatnonzero(classes == ord(EMOJI_SEPARATOR))
+    if np.isin(classes, SEQUENCE_MARKERS).any():
+        classes = classes.tobytes().decode('utf-32-le')
+        positions = [match.start() for match in EMOJI_SEQUENCE_PATTERN.finditer(classes)]
+    else:
+        positions = np.flatnonzero(classes == ord(EMOJI))
+    return count_by_position(positions, text_ends, len(texts))
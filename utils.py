@@ -1,5 +1,10 @@
 import hashlib
-import tkinter as tk
+import os
+from datetime import datetime
+from functools import lru_cache
+from math import log, pow
+
+from archives import get_size, open_file, open_text_file
 
 DEFAULT_VALUE = ""
 DEFAULT_VALUE_NUM = -1
@@ -28,17 +33,36 @@ PLATFORM_TO_ID = {
 }
 
 
-def get_hash(value):
-    value_str = str(value)
-    hash_object = hashlib.sha256(value_str.encode())
-    hash_int = int(hash_object.hexdigest(), 16)
-    scaled_value = hash_int % int(1e6)
-    return scaled_value
+def get_file_hash(path, size=None):
+    # hash of the file name and its first size bytes, the whole file by default
+    if size is None:
+        size = get_size(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{os.path.basename(path)}:{size}:'.encode())
+    with open_file(path) as f:
+        while size > 0:
+            chunk = f.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+# messages of a chat come in runs of the same minutes and dates, a bounded cache keeps the hits of a chat and
+# doesn't grow with the life of a pool or batch worker
+TIMESTAMP_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def get_minute_timestamp(year, month, day, hour, minute):
+    return int(datetime(int(year), int(month), int(day), int(hour), int(minute)).timestamp())
 
 
 def catch_command_errors(command_name):
     def catch_error(func):
         def wrapper(self, *args, **kwargs):
+            import tkinter as tk
             ok = True
             try:
                 func(self, *args, **kwargs)
@@ -62,11 +86,18 @@ def catch_command_errors(command_name):
     return catch_error
 
 
-def read_file(filename):
-    with open(filename, "r", encoding="utf-8") as f:
-        return f.read()
+def convert_size(size_bytes):
+    if size_bytes == 0:
+        return "0B"
+
+    size_name = ("B", "KB", "MB", "GB", "TB", "PB")
+    i = int(min(len(size_name) - 1, (log(size_bytes, 1024))))  # Use math.log
+    p = pow(1024, i)  # Use math.pow
+    s = round(size_bytes / p, 2)
+
+    return f"{s} {size_name[i]}"
 
 
 def read_html_file(filename):
-    with open(filename, 'r', encoding='windows-1251') as file:
+    with open_text_file(filename, 'windows-1251') as file:
         return file.read()